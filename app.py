@@ -13,11 +13,10 @@ Requirements:
 - redis: An in-memory data structure store used for caching. // Used with the worker as a broker between the web process and the worker process.
 - celery: A distributed task queue for asynchronous processing. // Used to process the video and not overload the web process.
 - Flask-SocketIO: Extension for WebSocket support in Flask applications. // Used for bi-directional communiation between client and server.
-- apscheduler: A Python library for scheduling tasks.
 
 """
 
-from flask import Flask, render_template,redirect,url_for,session,request,jsonify
+from flask import Flask, render_template,redirect,url_for,session,request,jsonify,abort,make_response,send_file
 import cloudinary,os
 
 cloudinary.config(
@@ -26,41 +25,76 @@ cloudinary.config(
     api_secret= os.environ.get('CLOUDINARY_API_SECRET')
 )
 
-import cv2,json,cloudinary.uploader
-from src.angle_calculation import process_image
+import json,gzip,hmac,math,time,cloudinary.uploader
+from contextlib import ExitStack
+from src.angle_calculation import angles_from_landmarks,pelvis_orientation
 from werkzeug.utils import secure_filename
-from src.angle_classification import  angle_classification
+from werkzeug.exceptions import HTTPException
+from src.angle_classification import  angle_classification,encode_poses,load_references,reference_index,segment_classification
+from src.temporal import smooth_landmarks
 from src.pose import Pose
-from src.animation_creation import animation_creation
+from src.animation_creation import animation_from_landmarks,encode_animation,decode_animation,slice_animation
+from src.video_analysis import analyse_video,warm_up_poses,close_poses
+from src.frame_pipeline import frame_rate,video_duration
+from src.landmark_cache import LandmarkCache,DirectoryBackend,RedisBackend
+from src.storage import LocalStorage,CloudinaryStorage
+from src.result_store import ResultStore,LocalBlobStore
+from src.temp_store import TempStore,JOB_ID
+from src.admission import AdmissionControl,choose_queue
+from src.metrics import metrics,flush_to_redis,read_from_redis,render_prometheus,write_json_line
 from datetime import datetime
 import redis
 import celery
 from celery import Celery
-from celery.schedules import crontab
 from celery.result import AsyncResult
+from celery.signals import worker_process_init,worker_process_shutdown,before_task_publish,task_prerun,task_postrun,task_failure
 from config import Config
 from flask_socketio import SocketIO,emit,join_room
 from urllib import parse
-import atexit
-from apscheduler.schedulers.background import BackgroundScheduler
 
 
 app = Flask(__name__)
-socketio = SocketIO(app)
+# The message queue lets the Celery workers emit to the rooms of the web clients
+socketio = SocketIO(app,message_queue=Config.REDIS_URL)
 app.config['UPLOAD_TIMEOUT'] = 300
 celery = Celery(app.name)
 celery.conf.update(broker_url = os.environ.get('REDIS_URL'),
-                   result_backend= os.environ.get('REDIS_URL'))
+                   result_backend= os.environ.get('REDIS_URL'),
+                   # a worker takes one video at a time, the others stay in the queue for the idle workers
+                   worker_prefetch_multiplier = 1,
+                   # a task acknowledged late is redelivered after this time, so it must exceed the longest video
+                   broker_transport_options = {'visibility_timeout': Config.TASK_VISIBILITY_TIMEOUT})
 app.secret_key = 'VISION'
 
 # Set Redis connection:
 redis_url = parse.urlparse(Config.REDIS_URL)
 r = redis.StrictRedis(host=redis_url.hostname, port=redis_url.port, db=1, password=redis_url.password)
 
+# Set landmark cache:
+if Config.LANDMARK_CACHE_BACKEND == 'redis':
+    landmark_cache = LandmarkCache(RedisBackend(r,Config.LANDMARK_CACHE_MAX_BYTES,Config.LANDMARK_CACHE_TTL))
+else:
+    landmark_cache = LandmarkCache(DirectoryBackend(Config.LANDMARK_FOLDER,Config.LANDMARK_CACHE_MAX_BYTES,Config.LANDMARK_CACHE_TTL))
+
+# Set admission control of the jobs, the queue depths are read from the Celery broker:
+admission = AdmissionControl(r,redis.StrictRedis.from_url(Config.CELERY_BROKER_URL),Config.USER_MAX_JOBS,
+                             Config.QUEUE_MAX_DEPTH,Config.ADMISSION_SLOT_TTL)
+
+# Set storage of the job results:
+results = ResultStore(r,Config.RESULT_TTL,Config.RESULT_COMPRESS_BYTES,Config.RESULT_SPILL_BYTES,
+                      LocalBlobStore(Config.RESULT_BLOB_FOLDER,Config.RESULT_TTL))
+
 
 print(cloudinary.config)
-UPLOAD_FOLDER = 'static/temp'
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Set storage of the temporary files, one folder per job, served under /static/temp:
+temp_store = TempStore(Config.TEMP_FOLDER,r,Config.TEMP_MAX_BYTES,Config.TEMP_TTL)
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = Config.STATIC_MAX_AGE
+
+# Set storage of the uploaded videos, local uploads go to the folder of their job:
+if Config.STORAGE_BACKEND == 'cloudinary':
+    storage = CloudinaryStorage(r)
+else:
+    storage = LocalStorage(Config.TEMP_FOLDER)
 
 
 def generate_unique_filename(filename,id):
@@ -86,36 +120,164 @@ def generate_unique_identifier():
     """
     return datetime.now().strftime('%Y%m%d%H%M%S%f')
 
-def delete_temp():
-    """
-    Delete temporary files from the 'static/temp' folder.
-    This function is scheduled to run at regular intervals.
+def upload_filename(filename,kind,id):
     """
-    folder_path = 'static/temp/'
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        try:
-            if os.path.isfile(file_path):
-                os.unlink(file_path)
-        except Exception as e:
-            print(f"Erreur lors de la suppression du fichier {file_path}: {e}")
+    Name of an uploaded video in the upload storage, in the folder of its job.
+    One name per kind so that the classification and the modelisation of the same video do not collide.
 
+    Args:
+        filename (str): The secured name of the uploaded file.
+        kind (str): 'classification' or 'modelisation'.
+        id (str): The unique identifier.
+
+    Returns:
+        str: The name of the video in the upload storage.
+    """
+    if not JOB_ID.match(id):
+        abort(404)
+    return f"{id}/{generate_unique_filename(filename,f'{kind}_{id}')}"
 
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=delete_temp, trigger="interval", hours=12)
-scheduler.start()
+@celery.task
+def clean_temp():
+    """
+    Celery beat task removing the expired and least recently used job folders of the temp store, a batch at a time.
+    Every worker may run the beat, the temp store lock lets one cleanup run per interval.
 
-atexit.register(lambda: scheduler.shutdown())
+    Returns:
+        int: Number of job folders removed, None when skipped.
+    """
+    return temp_store.clean(Config.TEMP_CLEAN_BATCH,Config.TEMP_CLEAN_INTERVAL//2)
 
 celery.conf.beat_schedule = {
-    'delete-temp': {
-        'task': 'delete_temp',
-        'schedule': crontab(hour=0, minute=0),  
+    'clean-temp': {
+        'task': clean_temp.name,
+        'schedule': Config.TEMP_CLEAN_INTERVAL,
     },
 }
 
-@celery.task
-def process_video(filename,filename_save,id):
+def publish_status(event,id,**data):
+    """
+    Push a task status event to the room of a job and keep it as the last known status of the job.
+    Can be called from the web process as well as from a Celery worker.
+    The last status is kept per kind of task, given by the event prefix ('classification' or 'modelisation').
+
+    Args:
+        event (str): Name of the event, e.g. 'classification_processing' or 'classification_completed'.
+        id (str): The unique identifier of the job, also the name of its room.
+        **data: Additional data of the event, e.g. progress.
+    """
+    payload = dict(id=id,room=id,**data)
+    kind = event.split('_')[0]
+    with metrics.timer("redis_write",key="status"):
+        r.set(f"status_{kind}_{id}",json.dumps({'event':event,'data':payload}),ex=Config.STATUS_TTL)
+    socketio.emit(event,payload,room=id)
+
+def progress_publisher(event,id,start,end):
+    """
+    Build a progress callback publishing the progress of a task stage as a percentage.
+
+    Args:
+        event (str): Name of the processing event.
+        id (str): The unique identifier of the job.
+        start (float): Percentage at the beginning of the stage.
+        end (float): Percentage at the end of the stage.
+
+    Returns:
+        callable: Callback taking the processed fraction of the stage.
+    """
+    def publish(fraction):
+        publish_status(event,id,progress=round(start+(end-start)*fraction,1))
+    return publish
+
+@worker_process_init.connect
+def warm_up_worker(**kwargs):
+    """
+    Prepare a Celery worker process before its first task: build and warm up its Pose graphs,
+    one per video segment, and load the reference poses of the classification and their index.
+    """
+    warm_up_poses(Config.VIDEO_SEGMENTS)
+    load_references()
+    reference_index()
+
+@worker_process_shutdown.connect
+def release_worker(**kwargs):
+    close_poses()
+
+# Start of the running tasks of this worker process and counters when they started
+_running_tasks = {}
+
+@before_task_publish.connect
+def stamp_task(headers=None,**kwargs):
+    """
+    Stamp the time a task is queued, to measure how long it waits for a worker.
+    """
+    if headers is not None:
+        headers['enqueued_at'] = time.time()
+
+@task_prerun.connect
+def start_task_metrics(task_id=None,task=None,**kwargs):
+    _running_tasks[task_id] = (time.time(),metrics.snapshot())
+
+@task_postrun.connect
+def record_task_metrics(task_id=None,task=None,state=None,**kwargs):
+    """
+    Record the metrics of a finished task: queue wait, run time, frames processed, dropped detections and the time
+    of each stage. Counters are added to the totals in Redis served by /metrics and, when Config.METRICS_LOG is set,
+    the task is written as one JSON line.
+    """
+    if task_id not in _running_tasks:
+        return
+    started,before = _running_tasks.pop(task_id)
+    run_time = time.time() - started
+    enqueued_at = task.request.get('enqueued_at') if task is not None else None
+    queue_wait = max(0.0,started-enqueued_at) if enqueued_at else None
+    name = task.name.rsplit('.',1)[-1] if task is not None else 'unknown'
+    metrics.observe("task_run",run_time,task=name,state=state)
+    if queue_wait is not None:
+        metrics.observe("task_queue_wait",queue_wait,task=name)
+    if Config.METRICS_LOG:
+        delta = {series:value-before.get(series,0) for series,value in metrics.snapshot().items() if value != before.get(series,0)}
+        write_json_line(Config.METRICS_LOG,{'task':name,'task_id':task_id,'state':state,'queue_wait':queue_wait,
+                                            'run_time':run_time,'frames':delta.pop('visualtango_frames_total',0),
+                                            'dropped_detections':delta.pop('visualtango_dropped_detections_total',0),
+                                            'metrics':delta})
+    flush_to_redis(r)
+
+def video_task_job(task,args,kwargs):
+    """
+    Args:
+        task (celery.Task): A Celery task.
+        args (tuple): Positional arguments of the task.
+        kwargs (dict): Keyword arguments of the task.
+
+    Returns:
+        tuple: Kind ('classification' or 'modelisation') and id of the job of a video task, None for the other tasks.
+    """
+    kind = {process_video.name:'classification',process_animation.name:'modelisation'}.get(getattr(task,'name',None))
+    if kind is None:
+        return None
+    return kind,args[2] if args and len(args) > 2 else (kwargs or {}).get('id')
+
+@task_postrun.connect
+def release_admission(task=None,args=None,kwargs=None,**_):
+    """
+    Free the admission slot of a finished video task, whatever its outcome.
+    """
+    job = video_task_job(task,args,kwargs)
+    if job is not None:
+        admission.release(f"{job[0]}_{job[1]}")
+
+@task_failure.connect
+def publish_failure(sender=None,exception=None,args=None,kwargs=None,**_):
+    """
+    Tell the client of a failed video task, the status is kept so that a client joining later sees it too.
+    """
+    job = video_task_job(sender,args,kwargs)
+    if job is not None:
+        publish_status(f"{job[0]}_failed",job[1],error=str(exception) or type(exception).__name__)
+
+@celery.task(acks_late=True,reject_on_worker_lost=True)
+def process_video(filename,filename_save,id,sampling=None,preview=None):
     """
     Celery task executed on a celery worker which rocess a video for pose analysis and classification.
     Need some modification to work with the external storage service. 
@@ -125,59 +287,122 @@ def process_video(filename,filename_save,id):
         filename (str): The name of the uploaded video file.
         filename_save (str): The name to save the processed results.
         id (str): The unique identifier for the task.
+        sampling (dict): Frames analysed by the pose estimation (stride, target_fps, threshold), defaults to Config.VIDEO_SAMPLING.
+            Frames that are not analysed keep the landmarks of the previous one, so the output still has one pose per frame.
+        preview (bool): Debug mode: write an annotated preview video to preview_<id>.mp4 in the temp store, defaults to Config.DEBUG_RENDER.
+
+    With Config.SEGMENT_CLASSIFICATION, the landmarks are smoothed over time and the clip is split into stable pose intervals:
+    the save file still holds one pose per frame, the pose of its interval, since the viewer plays one pose per frame,
+    and segments_<id>.json holds the frames of each interval.
+    The outputs are written to the folder of the job in the temp store, which is leased while the task runs.
 
     Returns:
-        dict: The result of the pose analysis.
-    """
-    res = process_image(os.path.join(app.config['UPLOAD_FOLDER'], filename))
+        list: The (code, start, end) segments, or the angles of each frame when segmentation is disabled.
+    """
+    if sampling is None:
+        sampling = Config.VIDEO_SAMPLING
+    if preview is None:
+        preview = Config.DEBUG_RENDER
+    temp_store.lease(id,Config.TEMP_TASK_LEASE)
+    preview_path = temp_store.path(id,f"preview_{id}.mp4") if preview else None
+    # a local copy of the video, so that the landmark cache can hash it even when it is stored remotely
+    with ExitStack() as stack:
+        with metrics.timer("storage_io",operation="source"):
+            source = stack.enter_context(storage.local_copy(filename))
+        landmarks,detected = analyse_video(source,landmark_cache,Config.FRAME_QUEUE_DEPTH,
+                                  Config.VIDEO_SEGMENTS,Config.VIDEO_SEGMENT_OVERLAP,sampling,preview_path,
+                                  progress_publisher('classification_processing',id,0,90))
+    if Config.SEGMENT_CLASSIFICATION:
+        with metrics.timer("stage",stage="smoothing"):
+            landmarks = smooth_landmarks(landmarks,detected,Config.SMOOTHING_WINDOW)
+    with metrics.timer("stage",stage="angles"):
+        res = angles_from_landmarks(landmarks)
+        orientation = pelvis_orientation(landmarks,detected)
     poses=[]
-    to_save = angle_classification(poses,res)
-    with open(f"static/temp/{filename_save}", "w") as output_file:
-        output_file.write(to_save)
-    os.remove(f'{app.config["UPLOAD_FOLDER"]}/{filename}')
+    with metrics.timer("stage",stage="classification"):
+        if Config.SEGMENT_CLASSIFICATION:
+            segments = segment_classification(res,Config.SEGMENT_MIN_FRAMES,orientation=orientation,nprobe=Config.ANN_NPROBE)
+            # the viewer advances one pose per frame, so each interval is written once per frame it covers
+            poses = [pose for pose,start,end in segments for _ in range(end-start)]
+            res = [(encode_poses([pose]),start,end) for pose,start,end in segments]
+            to_save = encode_poses(poses)
+        else:
+            to_save = angle_classification(poses,res,orientation,Config.ANN_NPROBE)
+    with metrics.timer("stage",stage="serialization"):
+        temp_store.write(id,filename_save,to_save)
+        if Config.SEGMENT_CLASSIFICATION:
+            temp_store.write(id,f"segments_{id}.json",json.dumps([{'pose':code,'start':start,'end':end} for code,start,end in res]))
+    metrics.inc("output_bytes_total",len(to_save),output="classification")
+    with metrics.timer("storage_io",operation="delete"):
+        storage.delete(filename)
+    temp_store.lease(id,Config.TEMP_VIEW_LEASE)
+    publish_status('classification_completed',id,progress=100)
     return res 
 
-@celery.task
-def process_animation(filename,filename_animation,public_id_video,id):
+@celery.task(acks_late=True,reject_on_worker_lost=True)
+def process_animation(filename,filename_animation,id):
     """
     Process a video to create an animation of dance poses.
-    Need some modification to work with the external storage service. 
-    You'll need to access the uploaded video on the storage service, then process it.
+    The video is read from the upload storage.
     
     Args:
         filename (str): The name of the uploaded video file.
         filename_animation (str): The name to save the animation results.
-        public_id_video (str): The public ID of the video in Cloudinary.
         id (str): The unique identifier for the task.
 
     Returns:
-        dict: The result of the animation creation.
-    """
-    url_video = cloudinary.CloudinaryVideo(public_id_video)
-    res = animation_creation(url_video)
-    serialized_res = json.dumps(res)
-    r.set(f"res_modelisation_{id}",serialized_res)
-    r.set(f"filename_animation_{id}",filename_animation)
-    r.set(f"filename_{id}",filename)
-    r.set(f"public_key_{id}",public_id_video)
-    # print(filename_animation)
-    """with open(f"static/temp/{filename_animation}", "w") as f:
-        f.writelines(["%s\n" % item for item in res])
-
-    os.remove(f'{app.config["UPLOAD_FOLDER"]}/{filename}')"""
-    return res 
+        dict: Number of frames of the animation, which is stored in the job results as a binary payload.
+    """
+    temp_store.lease(id,Config.TEMP_TASK_LEASE)
+    # The video shares its landmarks with the classification of the same video through the cache
+    with ExitStack() as stack:
+        with metrics.timer("storage_io",operation="source"):
+            source = stack.enter_context(storage.local_copy(filename))
+        landmarks,detected = analyse_video(source,landmark_cache,Config.FRAME_QUEUE_DEPTH,
+                                  Config.VIDEO_SEGMENTS,Config.VIDEO_SEGMENT_OVERLAP,
+                                  progress=progress_publisher('modelisation_processing',id,0,95))
+        fps = frame_rate(source)
+    with metrics.timer("stage",stage="serialization"):
+        serialized_res = encode_animation(landmarks,fps)
+    with metrics.timer("redis_write",key="animation"):
+        results.save(id,animation=serialized_res,filename_animation=filename_animation,filename=filename)
+    metrics.inc("output_bytes_total",len(serialized_res),output="animation")
+    temp_store.lease(id,Config.TEMP_VIEW_LEASE)
+    publish_status('modelisation_completed',id,progress=100)
+    return {'frames': len(landmarks)}
 
 @app.after_request
 def add_header(r):
     """
-    Add headers to both force latest IE rendering engine or Chrome Frame,
-    and also to cache the rendered page for 10 minutes.
+    Keep the rendered pages, which depend on the state of the jobs, out of the caches.
+    Files and payloads that set their own cache policy (static assets, temp files) keep it.
+    """
+    if 'Cache-Control' not in r.headers:
+        r.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    return r
+
+@app.route('/static/temp/<name>')
+def temp_file(name):
+    """
+    Route: /static/temp/<name>
+
+    Serves a file of a job from the temp store, e.g. save_<id>.txt or AnimationFile_<id>.txt, the job id being the end of the name.
+    The file may be rewritten by a new task of the same job, so the client revalidates it with its ETag and modification time.
+
+    Args:
+        name (str): Name of the file.
+
+    Returns:
+        Response: The file, or 304 when the client copy is up to date.
     """
-    r.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    r.headers["Pragma"] = "no-cache"
-    r.headers["Expires"] = "0"
-    r.headers['Cache-Control'] = 'public, max-age=0'
-    return r   
+    id = os.path.splitext(name)[0].rpartition('_')[2]
+    path = temp_store.find(id,secure_filename(name))
+    if path is None:
+        abort(404)
+    temp_store.lease(id,Config.TEMP_VIEW_LEASE)
+    response = send_file(path,conditional=True,max_age=0)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/')
 def index():
@@ -206,9 +431,13 @@ def menu(id):
         id (str): The unique identifier.
 
     Returns:
-        Response: Renders the 'index.html' template with the provided identifier.
+        Response: Renders the 'index.html' template with the provided identifier and the upload chunk size,
+            or a busy page when the admission control would refuse a new job.
     """
-    return render_template('index.html',id=id)
+    refused = admission.check(client_id())
+    if refused is not None:
+        return busy_page(id,refused)
+    return render_template('index.html',id=id,chunk_size=Config.UPLOAD_CHUNK_SIZE)
 
 
 @app.route('/visualtango/<id>', methods=['POST'])
@@ -225,10 +454,236 @@ def visualtango(id):
         Response: Renders the 'visualtango.html' template with the provided identifier.
     """
     filename_save = generate_unique_filename("save.txt",id)
-    with open(f"static/temp/{filename_save}", "w") as output_file:
-            output_file.write("00003000")
+    if not JOB_ID.match(id):
+        abort(404)
+    temp_store.write(id,filename_save,"00003000")
     return render_template('visualtango.html',id=id)
 
+def probe_duration(source):
+    """
+    Estimate the duration of a video from the web process. Opening a remote video is a blocking call of FFmpeg that
+    eventlet cannot switch around, so under eventlet it runs in the native thread pool and the other requests keep being served.
+
+    Args:
+        source (str): Path or URL of the video.
+
+    Returns:
+        float: Duration in seconds, 0 when unknown.
+    """
+    try:
+        from eventlet import patcher,tpool
+    except ImportError:
+        return video_duration(source)
+    if patcher.is_monkey_patched('socket'):
+        return tpool.execute(video_duration,source)
+    return video_duration(source)
+
+def enqueue_video_task(task,filename,args):
+    """
+    Send a video task to the queue matching its estimated cost, the duration of the video read from its container.
+
+    Args:
+        task (celery.Task): process_video or process_animation.
+        filename (str): The name of the video in the upload storage.
+        args (tuple): Arguments of the task.
+
+    Returns:
+        celery.result.AsyncResult: The queued task.
+    """
+    with metrics.timer("storage_io",operation="probe"):
+        duration = probe_duration(storage.source(filename))
+    queue = choose_queue(duration,(Config.QUEUE_SHORT_SECONDS,Config.QUEUE_MEDIUM_SECONDS))
+    metrics.inc("tasks_queued_total",queue=queue)
+    return task.apply_async(args,queue=queue)
+
+def client_id():
+    """
+    Returns:
+        str: Address of the client, behind the proxies of the platform, used as the user of the admission control.
+    """
+    return request.access_route[0] if request.access_route else (request.remote_addr or 'unknown')
+
+# Message shown on the menu for each reason of refusal of the admission control.
+BUSY_MESSAGES = {'queue_full':"The server is busy, the page will reload in {} seconds.",
+                 'user_limit':"Your previous videos are still being processed, the page will reload in {} seconds."}
+
+def admit(kind,id):
+    """
+    Admission check of a new job, before its video is uploaded.
+
+    Args:
+        kind (str): 'classification' or 'modelisation'.
+        id (str): The unique identifier.
+
+    Returns:
+        str: None when the job is accepted, otherwise the reason of the refusal, see AdmissionControl.admit.
+    """
+    refused = admission.admit(client_id(),f"{kind}_{id}")
+    metrics.inc("admission_total",result=refused or 'accepted')
+    return refused
+
+def refusal(refused,offset=0):
+    """
+    Args:
+        refused (str): Reason of the refusal of a job.
+        offset (int): Number of bytes of the upload already received.
+
+    Returns:
+        Response: 503 with a Retry-After header, for the chunked uploader.
+    """
+    response = jsonify(offset=offset,error=refused,retry_after=Config.ADMISSION_RETRY_AFTER)
+    response.status_code = 503
+    response.headers['Retry-After'] = str(Config.ADMISSION_RETRY_AFTER)
+    return response
+
+def chunked_upload_done(kind,id):
+    """
+    Tell whether a form post only opens the processing page of a chunked upload, which was admitted chunk by chunk.
+    The uploader marks the post with uploaded=1; it is only trusted when the post carries no file and the task of the
+    upload was started. The body is then only read when the mark is present.
+
+    Args:
+        kind (str): 'classification' or 'modelisation'.
+        id (str): The unique identifier.
+
+    Returns:
+        bool: True if the admission check can be skipped.
+    """
+    return bool(request.args.get('uploaded')) and not request.files and bool(r.exists(f"task_{kind}_{id}"))
+
+def busy_page(id,refused):
+    """
+    Args:
+        id (str): The unique identifier.
+        refused (str): Reason of the refusal of a job.
+
+    Returns:
+        Response: The menu with the reason of the refusal, reloading itself after Retry-After, with a 503 status.
+    """
+    page = render_template('index.html',id=id,chunk_size=Config.UPLOAD_CHUNK_SIZE,retry_after=Config.ADMISSION_RETRY_AFTER,
+                           busy=BUSY_MESSAGES[refused].format(Config.ADMISSION_RETRY_AFTER))
+    return page,503,{'Retry-After':str(Config.ADMISSION_RETRY_AFTER)}
+
+# Lowest valid value of each sampling option of a request, whether that value is excluded, and whether the option is a whole number.
+SAMPLING_LIMITS = {'stride':(1,False,True),'target_fps':(0,True,False),'threshold':(0,False,False)}
+
+def sampling_options():
+    """
+    Read the frame sampling options of the request (stride, target_fps, threshold), see process_video.
+    Aborts with 400 when a value is not a number, out of range, or fractional for the stride.
+
+    Returns:
+        dict: The given options.
+    """
+    sampling = {}
+    for key,(low,excluded,whole) in SAMPLING_LIMITS.items():
+        if not request.values.get(key):
+            continue
+        try:
+            value = float(request.values[key])
+        except ValueError:
+            abort(400,f"{key} must be a number")
+        if not math.isfinite(value) or value < low or (excluded and value == low):
+            abort(400,f"{key} must be {'greater than' if excluded else 'at least'} {low}")
+        if whole and not value.is_integer():
+            abort(400,f"{key} must be a whole number")
+        sampling[key] = int(value) if whole else value
+    return sampling
+
+def start_classification(id,filename,sampling=None):
+    """
+    Start the classification of an uploaded video.
+
+    Args:
+        id (str): The unique identifier.
+        filename (str): The name of the video in the upload storage.
+        sampling (dict): Frames analysed by the pose estimation, see process_video.
+
+    Returns:
+        str: The id of the Celery task.
+    """
+    filename_save = generate_unique_filename("save.txt",id)
+    r.delete(f"status_classification_{id}")
+    if sampling is None:
+        sampling = sampling_options()
+    task = enqueue_video_task(process_video,filename,(filename,filename_save,id,sampling or None))
+    r.set(f"task_classification_{id}",task.id,ex=Config.STATUS_TTL)
+    return task.id
+
+def start_modelisation(id,filename):
+    """
+    Start the modelisation of an uploaded video.
+
+    Args:
+        id (str): The unique identifier.
+        filename (str): The name of the video in the upload storage.
+
+    Returns:
+        str: The id of the Celery task.
+    """
+    filename_animation = generate_unique_filename("AnimationFile.txt",id)
+    r.delete(f"status_modelisation_{id}")
+    task = enqueue_video_task(process_animation,filename,(filename,filename_animation,id))
+    r.set(f"task_modelisation_{id}",task.id,ex=Config.STATUS_TTL)
+    return task.id
+
+@app.route('/upload/<id>/<kind>', methods=['GET','POST'])
+def upload(id,kind):
+    """
+    Route: /upload/<id>/<kind>
+
+    Chunked, resumable upload of a video straight to the upload storage.
+    GET returns the number of bytes already received for the file, to resume an interrupted upload.
+    Both GET and POST answer 503 with a Retry-After header when the job is refused by the admission control.
+    POST appends the chunk given in the request body at the position of its Content-Range header
+    ("bytes <start>-<end>/<total>"). Once the last chunk is received, the task is started and its id returned.
+
+    Args:
+        id (str): The unique identifier.
+        kind (str): 'classification' or 'modelisation'.
+
+    Query parameters:
+        name (str): Name of the uploaded file.
+
+    Returns:
+        Response: JSON with the number of bytes received ("offset") and, once complete, the task id ("task_id").
+    """
+    if kind not in ('classification','modelisation'):
+        abort(404)
+    name = secure_filename(request.args.get('name',''))
+    if name == '':
+        abort(400)
+    filename = upload_filename(name,kind,id)
+    received = storage.size(filename)
+    if request.method == 'GET':
+        refused = admit(kind,id)
+        return jsonify(offset=received) if refused is None else refusal(refused)
+    try:
+        unit,_,positions = request.headers['Content-Range'].partition(' ')
+        start,_,total = positions.partition('/')
+        start,total = int(start.split('-')[0]),int(total)
+    except (KeyError,ValueError):
+        abort(400)
+    if unit != 'bytes' or start != received:
+        return jsonify(offset=received),409
+    # every chunk needs the slot of the job, which also renews it during long uploads
+    refused = admit(kind,id)
+    if refused is not None:
+        return refusal(refused,received)
+    if kind == 'classification':
+        # the last chunk starts the task, reject invalid options before storing it
+        sampling_options()
+    temp_store.lease(id,Config.TEMP_TASK_LEASE)
+    with metrics.timer("storage_io",operation="write_chunk"):
+        received = storage.write_chunk(filename,start,total,request.stream)
+    if received < total:
+        return jsonify(offset=received)
+    if kind == 'classification':
+        task_id = start_classification(id,filename)
+    else:
+        task_id = start_modelisation(id,filename)
+    return jsonify(offset=received,task_id=task_id)
+
 @app.route('/processing_classification/<id>', methods=['POST'])
 def classification(id):
     """
@@ -243,15 +698,27 @@ def classification(id):
     Returns:
         Response: Renders the 'processing_classification.html' template with the provided identifier.
     """
+    if request.method == 'POST' and request.content_length and not chunked_upload_done('classification',id):
+        # checked before request.files, which reads the whole video
+        refused = admit('classification',id)
+        if refused is not None:
+            return busy_page(id,refused)
     if request.method == 'POST' and 'input_file1' in request.files:
         file = request.files['input_file1']
         if file.filename == '':
+            admission.release(f"classification_{id}")
             return redirect(url_for('menu',id=id))
-        filename = secure_filename(file.filename)
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        filename_save = generate_unique_filename("save.txt",id)
-        all_poses = process_video.delay(filename,filename_save,id)
-        session['task_id'] = all_poses.id	
+        try:
+            sampling_options()
+        except HTTPException:
+            admission.release(f"classification_{id}")
+            raise
+        filename = upload_filename(secure_filename(file.filename),'classification',id)
+        # lease the job folder before writing into it, so that a cleanup cannot remove it mid-upload
+        temp_store.lease(id,Config.TEMP_TASK_LEASE)
+        with metrics.timer("storage_io",operation="save"):
+            storage.save(filename,file.stream)
+        start_classification(id,filename)
     return render_template('processing_classification.html',id=id)
 
 @app.route('/classification/<id>', methods=['POST'])
@@ -285,29 +752,22 @@ def modelisation(id):
     Returns:
         Response: Renders the 'processing_modelisation.html' template with the provided identifier.
     """
+    if request.method == 'POST' and request.content_length and not chunked_upload_done('modelisation',id):
+        # checked before request.files, which reads the whole video
+        refused = admit('modelisation',id)
+        if refused is not None:
+            return busy_page(id,refused)
     if request.method == 'POST' and 'input_file2' in request.files:
         file = request.files['input_file2']
         if file.filename =='':
+            admission.release(f"modelisation_{id}")
             return redirect(url_for('menu',id=id))
-        filename = secure_filename(file.filename)
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        upload_result = None
-        if file :
-            print(file)
-            
-            with open(os.path.join(app.config['UPLOAD_FOLDER'],filename), 'rb') as video_file:
-                upload_result = cloudinary.uploader.upload_large(video_file,
-                                                                resource_type="video",
-                                                                public_id=f"myfolder/mysubfolder/id_{filename}")
-                app.logger.info(upload_result)
-            
-        
-        #file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        filename_animation = generate_unique_filename("AnimationFile.txt",id)
-        
-        results = process_animation.delay(filename,filename_animation,upload_result['public_id'],id)
-        
-        session['task_id'] = results.id
+        filename = upload_filename(secure_filename(file.filename),'modelisation',id)
+        # lease the job folder before writing into it, so that a cleanup cannot remove it mid-upload
+        temp_store.lease(id,Config.TEMP_TASK_LEASE)
+        with metrics.timer("storage_io",operation="save"):
+            storage.save(filename,file.stream)
+        start_modelisation(id,filename)
     return render_template('processing_modelisation.html',id=id)
 
 @app.route('/modelisation/<id>', methods=['POST'])
@@ -323,26 +783,100 @@ def result_modelisation(id,):
     Returns:
         Response: Renders the "modelisation.html" template.
     """
-    poses=[]
-    serialized_res = r.get(f"res_modelisation_{id}")
-    if serialized_res is not None:
-        res = json.loads(serialized_res)
-    filename_animation = r.get(f"filename_animation_{id}")
-    if filename_animation is not None:
-        filename_animation = filename_animation.decode("utf-8")
-    filename = r.get(f"filename_{id}")
-    if filename is not None:
-        filename = filename.decode("utf-8")
-    public_id = r.get(f"public_key_{id}")
-    if public_id is not None:
-        public_id = public_id.decode("utf-8")
-    cloudinary.api.delete_resources([public_id], resource_type="video")
-
-    with open(f"static/temp/{filename_animation}", "w") as f:
-        f.writelines(["%s\n" % item for item in res])
-    os.remove(f'{app.config["UPLOAD_FOLDER"]}/{filename}')
+    serialized_res,filename_animation,filename = results.load(id,'animation','filename_animation','filename')
+    if serialized_res is None:
+        abort(404)
+    # the WebGL viewer reads the animation as text lines
+    res = animation_from_landmarks(decode_animation(serialized_res)[0])
+    filename_animation = filename_animation.decode("utf-8")
+    filename = filename.decode("utf-8")
+
+    # the results stay until they expire, the viewer still fetches /animation/<id>
+    temp_store.write(id,filename_animation,"".join(["%s\n" % item for item in res]))
+    storage.delete(filename)
     return render_template("modelisation.html")
 
+def flush_web_metrics():
+    """
+    Background task of a web process pushing its counters to Redis periodically, so that a scrape served by
+    another web process sees them.
+    """
+    while True:
+        socketio.sleep(Config.METRICS_FLUSH_INTERVAL)
+        flush_to_redis(r)
+
+@app.before_first_request
+def start_metrics_flush():
+    socketio.start_background_task(flush_web_metrics)
+
+def metrics_allowed():
+    """
+    Returns:
+        bool: True if the request may read the metrics: it carries the METRICS_TOKEN bearer token or,
+            without token configured, it comes from the local host and not through a proxy.
+    """
+    if Config.METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get('Authorization',''),f"Bearer {Config.METRICS_TOKEN}")
+    return request.remote_addr in ('127.0.0.1','::1') and 'X-Forwarded-For' not in request.headers
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Route: /metrics
+
+    Serves the counters of all the web and worker processes in the Prometheus text format.
+    Only served to local scrapes or to the holders of Config.METRICS_TOKEN.
+
+    Returns:
+        Response: Prometheus exposition text.
+    """
+    if not metrics_allowed():
+        abort(404)
+    flush_to_redis(r)
+    response = make_response(render_prometheus(read_from_redis(r)))
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    return response
+
+@app.route('/animation/<id>')
+def animation_payload(id):
+    """
+    Route: /animation/<id>
+
+    Serves the binary animation payload of a modelisation (see animation_creation.encode_animation),
+    gzip-compressed when the client accepts it.
+
+    Args:
+        id (str): The unique identifier.
+
+    Query parameters:
+        start (int): First frame to send, defaults to the first frame.
+        stop (int): Frame after the last one to send, defaults to the end of the animation.
+
+    Returns:
+        Response: The binary animation payload.
+    """
+    encoded, = results.load_encoded(id,'animation')
+    if encoded is None:
+        abort(404)
+    compressed,data = encoded
+    start = request.args.get('start',type=int)
+    stop = request.args.get('stop',type=int)
+    accepts_gzip = 'gzip' in request.headers.get('Accept-Encoding','')
+    if compressed and (start is not None or stop is not None or not accepts_gzip):
+        data = gzip.decompress(data)
+        compressed = False
+    if start is not None or stop is not None:
+        data = slice_animation(data,start,stop)
+    response = make_response(data)
+    response.headers['Content-Type'] = 'application/octet-stream'
+    response.headers['Vary'] = 'Accept-Encoding'
+    if accepts_gzip:
+        # the stored payload is already gzip-compressed when the whole animation is requested
+        if not compressed:
+            response.set_data(gzip.compress(data,compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 @socketio.on('join')
 def on_join(data):
     """
@@ -356,6 +890,19 @@ def on_join(data):
     room = data['room']
     join_room(room)
     print(f"User joined room: {room}")
+    # replay the last statuses, the task may have finished before the client joined
+    # the task of each room is found in Redis, so any web worker can serve the client
+    for kind in ('classification','modelisation'):
+        status,task_id = r.mget([f"status_{kind}_{room}",f"task_{kind}_{room}"])
+        if status is not None:
+            status = json.loads(status)
+            emit(status['event'],status['data'])
+        elif task_id is not None:
+            result = celery.AsyncResult(task_id.decode("utf-8"))
+            if result.failed():
+                emit(f'{kind}_failed',{'id':room,'room':room,'error':str(result.result)})
+            elif result.ready():
+                emit(f'{kind}_completed',{'id':room,'room':room})
 
 @socketio.on('connect')
 def on_connect():
@@ -367,60 +914,6 @@ def on_connect():
     print('Client connected')
     emit('status', {'msg': 'From the server : Connected'})
 
-@socketio.on('request_modelisation_status')
-def modelisation_status(data):
-    """
-    SocketIO Event Handler: request_modelisation_status
-
-    Responds to the client's request for modelization status.
-    Emits appropriate events indicating whether the task is completed or still processing.
-
-    Args:
-        data (dict): Data containing room information.
-
-    Notes:
-        The following events may be emitted:
-        - If the task is completed: emit 'modelisation_completed'
-        - If the task is still processing: emit 'modelisation_processing'
-    """
-    print('request received')
-    room = data['room']
-    task_id=session['task_id']
-    task = celery.AsyncResult(task_id)
-    if task.ready() :
-        print('tache finie !')      
-        emit('modelisation_completed',{'id': session['id'],'room':room},room=room)
-    else :
-        print('task not finished')
-        emit('modelisation_processing',{'id': session['id'],'room':room},room=room)
-
-@socketio.on('request_classification_status')
-def classification_status(data):
-    """
-    SocketIO Event Handler: request_classification_status
-
-    Responds to the client's request for classification status.
-    Emits appropriate events indicating whether the task is completed or still processing.
-
-    Args:
-        data (dict): Data containing room information.
-
-    Notes:
-        The following events may be emitted:
-        - If the task is completed: emit 'classification_completed'
-        - If the task is still processing: emit 'classification_processing'
-    """
-    print('request received')
-    room = data['room']
-    task_id=session['task_id']
-    task = celery.AsyncResult(task_id)
-    if task.ready() :
-        print('tache finie !')      
-        emit('classification_completed',{'id': session['id'],'room':room},room=room)
-    else :
-        print('task not finished')
-        emit('classification_processing',{'id': session['id'],'room':room},room=room)
-
 if __name__ == '__main__':
     socketio.run(app,debug=True)
     
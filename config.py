@@ -5,4 +5,65 @@ class Config:
     CELERY_BROKER_URL = os.environ.get('REDIS_URL')
     CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL')
     # Redis:
-    REDIS_URL = os.environ.get('REDIS_URL')
\ No newline at end of file
+    REDIS_URL = os.environ.get('REDIS_URL')
+    # Storage of the uploaded videos ('local' or 'cloudinary'):
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'cloudinary' if os.environ.get('CLOUDINARY_CLOUD_NAME') else 'local')
+    # Size of the chunks sent by the browser, Cloudinary needs at least 5 MB:
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 6 * 1024 * 1024))
+    # Metrics: JSON lines file receiving one record per task, disabled when empty:
+    METRICS_LOG = os.environ.get('METRICS_LOG')
+    # /metrics needs 'Authorization: Bearer METRICS_TOKEN', only local scrapes are served when empty.
+    # Web processes push their counters to Redis every METRICS_FLUSH_INTERVAL seconds:
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL', 15))
+    # Job results: one Redis hash per job expiring after RESULT_TTL seconds, values gzip-compressed from RESULT_COMPRESS_BYTES,
+    # and moved to RESULT_BLOB_FOLDER from RESULT_SPILL_BYTES once compressed (never when 0):
+    RESULT_TTL = int(os.environ.get('RESULT_TTL', 24 * 3600))
+    RESULT_COMPRESS_BYTES = int(os.environ.get('RESULT_COMPRESS_BYTES', 1024))
+    RESULT_SPILL_BYTES = int(os.environ.get('RESULT_SPILL_BYTES', 0))
+    RESULT_BLOB_FOLDER = os.environ.get('RESULT_BLOB_FOLDER', 'cache/results')
+    # Temp store: one folder per job under TEMP_FOLDER, bounded to TEMP_MAX_BYTES, unused folders expire after TEMP_TTL seconds.
+    # A job is leased for TEMP_TASK_LEASE seconds while processed and TEMP_VIEW_LEASE seconds after each view.
+    # The Celery beat removes at most TEMP_CLEAN_BATCH folders every TEMP_CLEAN_INTERVAL seconds:
+    TEMP_FOLDER = os.environ.get('TEMP_FOLDER', 'temp')
+    TEMP_MAX_BYTES = int(os.environ.get('TEMP_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+    TEMP_TTL = int(os.environ.get('TEMP_TTL', 12 * 3600))
+    TEMP_TASK_LEASE = int(os.environ.get('TEMP_TASK_LEASE', 2 * 3600))
+    TEMP_VIEW_LEASE = int(os.environ.get('TEMP_VIEW_LEASE', 1800))
+    TEMP_CLEAN_INTERVAL = int(os.environ.get('TEMP_CLEAN_INTERVAL', 300))
+    TEMP_CLEAN_BATCH = int(os.environ.get('TEMP_CLEAN_BATCH', 100))
+    # Browser cache lifetime in seconds of the static assets (stylesheets, WebGL builds):
+    STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))
+    # Lifetime in seconds of the last status pushed for each job:
+    STATUS_TTL = int(os.environ.get('STATUS_TTL', 3600))
+    # Task queues: videos up to QUEUE_SHORT_SECONDS go to video_short, up to QUEUE_MEDIUM_SECONDS to video_medium, the others
+    # to video_long. Tasks are acknowledged once done and redelivered after TASK_VISIBILITY_TIMEOUT seconds:
+    QUEUE_SHORT_SECONDS = float(os.environ.get('QUEUE_SHORT_SECONDS', 30))
+    QUEUE_MEDIUM_SECONDS = float(os.environ.get('QUEUE_MEDIUM_SECONDS', 180))
+    TASK_VISIBILITY_TIMEOUT = int(os.environ.get('TASK_VISIBILITY_TIMEOUT', 4 * 3600))
+    # Admission control: new jobs are refused for ADMISSION_RETRY_AFTER seconds when QUEUE_MAX_DEPTH tasks are waiting or
+    # the user already has USER_MAX_JOBS jobs, a job holds its slot until it ends or for ADMISSION_SLOT_TTL seconds:
+    QUEUE_MAX_DEPTH = int(os.environ.get('QUEUE_MAX_DEPTH', 50))
+    USER_MAX_JOBS = int(os.environ.get('USER_MAX_JOBS', 2))
+    ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', 30))
+    ADMISSION_SLOT_TTL = int(os.environ.get('ADMISSION_SLOT_TTL', 2 * 3600))
+    # Video processing:
+    FRAME_QUEUE_DEPTH = int(os.environ.get('FRAME_QUEUE_DEPTH', 8))
+    VIDEO_SEGMENTS = int(os.environ.get('VIDEO_SEGMENTS', 1))
+    VIDEO_SEGMENT_OVERLAP = int(os.environ.get('VIDEO_SEGMENT_OVERLAP', 15))
+    # Debug mode: write an annotated preview video of each classified upload:
+    DEBUG_RENDER = os.environ.get('DEBUG_RENDER', '0') == '1'
+    # Frame sampling of the classification (stride, target_fps, threshold), every frame is analysed when empty:
+    VIDEO_SAMPLING = {key: float(os.environ[name]) for key, name in (('stride', 'SAMPLING_STRIDE'),
+                      ('target_fps', 'SAMPLING_TARGET_FPS'), ('threshold', 'SAMPLING_THRESHOLD')) if os.environ.get(name)}
+    # Classification: frames classified by stable interval instead of one by one, landmarks smoothed over SMOOTHING_WINDOW frames:
+    SEGMENT_CLASSIFICATION = os.environ.get('SEGMENT_CLASSIFICATION', '1') == '1'
+    SMOOTHING_WINDOW = int(os.environ.get('SMOOTHING_WINDOW', 9))
+    SEGMENT_MIN_FRAMES = int(os.environ.get('SEGMENT_MIN_FRAMES', 8))
+    # Lists probed per frame when the reference library has an IVF index (python -m src.pose_index), higher for better recall:
+    ANN_NPROBE = int(os.environ.get('ANN_NPROBE', 8))
+    # Landmark cache, keyed by video content hash ('directory' or 'redis' backend):
+    LANDMARK_CACHE_BACKEND = os.environ.get('LANDMARK_CACHE_BACKEND', 'directory')
+    LANDMARK_FOLDER = os.environ.get('LANDMARK_FOLDER', 'cache/landmarks')
+    LANDMARK_CACHE_MAX_BYTES = int(os.environ.get('LANDMARK_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    LANDMARK_CACHE_TTL = int(os.environ.get('LANDMARK_CACHE_TTL', 7 * 24 * 3600))
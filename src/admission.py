@@ -0,0 +1,143 @@
+import time
+
+############################################################################################################################################
+################################################################ QUEUES  ###################################################################
+############################################################################################################################################
+
+# Celery queues of the video tasks, cheapest first. A worker dedicated to the first one keeps short clips from waiting
+# behind long ones.
+VIDEO_QUEUES = ("video_short","video_medium","video_long")
+
+def choose_queue(duration,limits):
+    """
+    Args:
+        duration (float): Estimated duration of the video in seconds, 0 when unknown.
+        limits (tuple): Longest duration of the short and medium queues in seconds.
+
+    Returns:
+        str: Queue of the task. Videos of unknown duration go to the medium queue.
+    """
+    if duration <= 0:
+        return VIDEO_QUEUES[1]
+    for queue,limit in zip(VIDEO_QUEUES,limits):
+        if duration <= limit:
+            return queue
+    return VIDEO_QUEUES[-1]
+
+
+############################################################################################################################################
+################################################################ ADMISSION  ################################################################
+############################################################################################################################################
+
+# Prunes the expired jobs of a user with their owner keys, then takes or renews the slot of a job unless the user is at
+# their limit, in one atomic step so that concurrent requests of a user cannot all pass the check before any of them adds
+# its job. KEYS: jobs of the user, owner key of the job. ARGV: now, job ('' to only check), expiry of the slot, slot ttl,
+# max jobs per user, '1' when the video queues are full, user, prefix of the owner keys.
+ADMIT_SCRIPT = """
+local expired = redis.call('zrangebyscore',KEYS[1],'-inf',ARGV[1])
+for _,job in ipairs(expired) do
+    redis.call('del',ARGV[8] .. job)
+end
+redis.call('zremrangebyscore',KEYS[1],'-inf',ARGV[1])
+local held = ARGV[2] ~= '' and redis.call('zscore',KEYS[1],ARGV[2])
+if not held then
+    if ARGV[6] == '1' then
+        return 'queue_full'
+    end
+    if redis.call('zcard',KEYS[1]) >= tonumber(ARGV[5]) then
+        return 'user_limit'
+    end
+end
+if ARGV[2] ~= '' then
+    redis.call('zadd',KEYS[1],ARGV[3],ARGV[2])
+    redis.call('expire',KEYS[1],ARGV[4])
+    redis.call('set',KEYS[2],ARGV[7],'EX',ARGV[4])
+end
+return false
+"""
+
+class AdmissionControl:
+    """
+    Decides whether a new job is accepted, before its video is uploaded.
+    A job is refused when the video queues hold too many waiting tasks, or when its user already has too many jobs
+    uploading, queued or running. The jobs of each user are kept in a Redis sorted set scored by their expiry,
+    so that an abandoned upload or a lost worker frees its slot after slot_ttl seconds, and the user of each job in a key
+    that expires with its slot.
+
+    Attributes:
+        connection (redis.StrictRedis): Redis connection of the slots.
+        broker (redis.StrictRedis): Redis connection of the Celery broker, whose queues are lists named after them.
+        max_per_user (int): Maximum number of jobs of a user at the same time.
+        max_depth (int): Maximum number of tasks waiting in the video queues.
+        slot_ttl (int): Time in seconds after which the slot of a job is freed.
+        prefix (str): Prefix of the Redis keys.
+    """
+    def __init__(self,connection,broker,max_per_user,max_depth,slot_ttl,prefix='admission'):
+        self.connection = connection
+        self.broker = broker
+        self.max_per_user = max_per_user
+        self.max_depth = max_depth
+        self.slot_ttl = slot_ttl
+        self.prefix = prefix
+        self._admit = connection.register_script(ADMIT_SCRIPT)
+
+    def queue_depth(self):
+        """
+        Returns:
+            int: Number of tasks waiting in the video queues.
+        """
+        pipe = self.broker.pipeline(transaction=False)
+        for queue in VIDEO_QUEUES:
+            pipe.llen(queue)
+        return sum(pipe.execute())
+
+    def _owner(self,job):
+        return f"{self.prefix}_owner_{job}"
+
+    def _take(self,user,job):
+        # the queue depth lives on the broker, it is read first and only bounds the depth approximately
+        queue_full = self.queue_depth() >= self.max_depth
+        now = time.time()
+        refused = self._admit(keys=[f"{self.prefix}_user_{user}",self._owner(job)],
+                              args=[now,job,now+self.slot_ttl,self.slot_ttl,self.max_per_user,int(queue_full),user,self._owner('')])
+        return refused.decode('utf-8') if refused is not None else None
+
+    def check(self,user):
+        """
+        Tell whether a new job of a user would be accepted now, without taking a slot. Used before showing the upload form.
+
+        Args:
+            user (str): Identifier of the user.
+
+        Returns:
+            str: None when a new job would be accepted, otherwise 'queue_full' or 'user_limit'.
+        """
+        return self._take(user,'')
+
+    def admit(self,user,job):
+        """
+        Take a slot for a job, or renew it when the job already holds one (e.g. a resumed upload).
+
+        Args:
+            user (str): Identifier of the user, e.g. the client address.
+            job (str): Identifier of the job, e.g. <kind>_<id>.
+
+        Returns:
+            str: None when the job is accepted, otherwise 'queue_full' or 'user_limit'.
+        """
+        return self._take(user,job)
+
+    def release(self,job):
+        """
+        Free the slot of a finished job.
+
+        Args:
+            job (str): Identifier of the job.
+        """
+        user = self.connection.get(self._owner(job))
+        if user is None:
+            return
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.zrem(f"{self.prefix}_user_{user.decode('utf-8')}",job)
+        pipe.delete(self._owner(job))
+        pipe.execute()
@@ -1,12 +1,9 @@
-import cv2
-import mediapipe as mp
 import numpy as np
 import math
-from flask_socketio import SocketIO,emit
 import ast
-
-mp_drawing = mp.solutions.drawing_utils
-mp_pose = mp.solutions.pose
+from src.frame_pipeline import DEFAULT_QUEUE_DEPTH
+from src.temporal import fill_missing
+from src.video_analysis import DEFAULT_SEGMENT_OVERLAP,extract_landmarks
 
 ############################################################################################################################################
 ###################################################### COORDINATE SYSTEM COMPUTATION  ######################################################
@@ -151,84 +148,170 @@ def angle(lmList,articulation,coordinate_system):
     return {"x":angle_yz,"y":angle_xz,"z":angle_xy}
 
 
+############################################################################################################################################
+################################################################ BATCH COMPUTATION  ########################################################
+############################################################################################################################################
+
+# Joints returned by batch_angles, in output order (same order as tomatrix.pose_to_matrix).
+JOINTS = ['RightHip', 'LeftHip', 'RightKnee', 'LeftKnee', 'RightAnkle', 'LeftAnkle']
+JOINT_ARTICULATIONS = [24, 23, 26, 25, 28, 27]
+
+def _normalise(vectors):
+    """
+    Normalise a stack of vectors along the last axis, leaving zero-norm vectors untouched.
+
+    Args:
+        vectors (numpy.array): Array of shape (..., 3).
+
+    Returns:
+        numpy.array: Normalised vectors.
+    """
+    norm = np.linalg.norm(vectors,axis=-1,keepdims=True)
+    return np.divide(vectors,norm,out=vectors.copy(),where=norm!=0)
+
+def _wrap_degrees(angles):
+    """
+    Convert angles from radians to degrees and wrap them into [-180, 180).
+
+    Args:
+        angles (numpy.array): Angles in radians.
+
+    Returns:
+        numpy.array: Angles in degrees.
+    """
+    angles = np.degrees(angles)
+    angles = np.where(angles < 0, angles + 360, angles)
+    return np.where(angles >= 180, angles - 360, angles)
+
+def batch_angles(landmarks):
+    """
+    Calculate the hip, knee and ankle angles of a whole clip in one vectorized pass.
+    Gives the same values as coordinate_system_initialisation() followed by angle() on every frame.
+
+    Args:
+        landmarks (numpy.array): Landmark tensor of shape (F, 33, 3).
+
+    Returns:
+        numpy.array: Angles in degrees of shape (F, 6, 3), joints ordered as JOINTS and axes as (x, y, z).
+    """
+    lm = np.asarray(landmarks,dtype=np.float64)
+    hips = np.array([a in COORDINATE_SYSTEM_INIT_DICT for a in JOINT_ARTICULATIONS])[:,None]
+    system_points = np.array([COORDINATE_SYSTEM_INIT_DICT.get(a,POSE_ARTICULATIONS[a]) for a in JOINT_ARTICULATIONS])
+    angle_points = np.array([POSE_ARTICULATIONS[a] for a in JOINT_ARTICULATIONS])
+
+    # Coordinate systems, one per joint and per frame
+    O = lm[:,system_points[:,1]]
+    OY = _normalise(lm[:,system_points[:,0]] - O)
+    temp = O - lm[:,system_points[:,2]]
+    first = _normalise(np.cross(temp,OY))
+    second = _normalise(np.cross(first,OY))
+    # The hips use (OZ, OX) = (first, OY x OZ), the other joints (OX, OZ) = (first, OX x OY)
+    OX = np.where(hips,-second,first)
+    OZ = np.where(hips,first,second)
+    P = np.stack((OX,OY,OZ),axis=-1)
+
+    # Points expressed in the coordinate system of their joint
+    new_A = np.matmul(P,(lm[:,angle_points[:,0]] - O)[...,None])[...,0]
+    new_B = np.matmul(P,(lm[:,angle_points[:,1]] - O)[...,None])[...,0]
+    new_C = np.matmul(P,(lm[:,angle_points[:,2]] - O)[...,None])[...,0]
+    AB = _normalise(new_A - new_B)
+    BC = _normalise(new_B - new_C)
+
+    angle_xy = np.arctan2(BC[...,1],BC[...,0]) - np.arctan2(AB[...,1],AB[...,0])
+    angle_xz = np.arctan2(BC[...,2],BC[...,0]) - np.arctan2(AB[...,2],AB[...,0])
+    angle_yz = np.arctan2(BC[...,2],BC[...,1]) - np.arctan2(AB[...,2],AB[...,1])
+    return _wrap_degrees(np.stack((angle_yz,angle_xz,angle_xy),axis=-1))
+
+def angles_to_dict(angles):
+    """
+    Convert the output of batch_angles() to the per-frame dictionary format returned by process_image().
+
+    Args:
+        angles (numpy.array): Angles of shape (F, 6, 3).
+
+    Returns:
+        dict: Dictionary containing angles for each frame.
+    """
+    all_poses = {}
+    for frame,values in enumerate(angles.tolist()):
+        all_poses[frame] = {joint:{"x":x,"y":y,"z":z} for joint,(x,y,z) in zip(JOINTS,values)}
+    return all_poses
+
+
+############################################################################################################################################
+################################################################ PELVIS ORIENTATION  #######################################################
+############################################################################################################################################
+
+# Hip and shoulder landmarks of MediaPipe Pose.
+LEFT_HIP,RIGHT_HIP,LEFT_SHOULDER,RIGHT_SHOULDER = 23,24,11,12
+
+def pelvis_orientation(landmarks,detected=None):
+    """
+    Calculate the heading of the pelvis and the forward lean of the torso on every frame.
+    The joint angles are measured in coordinate systems attached to the body, so they do not change when the dancer turns:
+    the orientation is what tells the rotations and directions of a pose apart.
+    MediaPipe axes are x to the right of the image, y down and z away from the camera.
+
+    Args:
+        landmarks (numpy.array): Landmarks of shape (F, 33, 3) or (F, 33, 4), as returned by video_analysis.extract_landmarks().
+        detected (numpy.array): Detection mask of shape (F,). The frames without detection, whose landmarks are zeros, take the
+            orientation of the closest previous detection, or face the camera upright when nothing is detected.
+
+    Returns:
+        tuple: Yaw of shape (F,) in degrees in [0, 360), 0 when the dancer faces the camera and growing when they turn to their left,
+            and pitch of shape (F,) in degrees, positive when the torso leans forward.
+    """
+    if detected is not None:
+        detected = np.asarray(detected,dtype=bool)
+        if not detected.any():
+            return np.zeros(len(detected)),np.zeros(len(detected))
+        landmarks = fill_missing(landmarks,detected)
+    lm = np.array(landmarks[...,:3],dtype=np.float64)
+    lm[...,0] = lm[...,0]*10
+    lm[...,1] = lm[...,1]*10
+    lm[...,2] = lm[...,2]*10/3
+    left = lm[:,LEFT_HIP] - lm[:,RIGHT_HIP]
+    # forward is horizontal: cross product of the hip line with the vertical
+    forward = _normalise(np.cross(left,np.array([0.0,-1.0,0.0])))
+    yaw = np.degrees(np.arctan2(forward[:,0],-forward[:,2])) % 360
+    spine = (lm[:,LEFT_SHOULDER] + lm[:,RIGHT_SHOULDER])/2 - (lm[:,LEFT_HIP] + lm[:,RIGHT_HIP])/2
+    pitch = np.degrees(np.arctan2(np.sum(spine*forward,axis=-1),-spine[:,1]))
+    return yaw,pitch
+
+
 ############################################################################################################################################
 ################################################################ VIDEO PROCESSING  #########################################################
 ############################################################################################################################################
 
-def process_image(file):
+def angles_from_landmarks(landmarks):
+    """
+    Calculate the angles of each frame from raw MediaPipe landmarks.
+
+    Args:
+        landmarks (numpy.array): Landmarks of shape (F, 33, 3) or (F, 33, 4), as returned by video_analysis.extract_landmarks().
+
+    Returns:
+        dict: Dictionary containing angles for each frame.
+    """
+    lmList = np.array(landmarks[...,:3],dtype=np.float64)
+    lmList[...,0] = lmList[...,0]*10
+    lmList[...,1] = lmList[...,1]*10
+    lmList[...,2] = lmList[...,2]*10/3
+    return angles_to_dict(batch_angles(lmList))
+
+def process_image(file,queue_depth=DEFAULT_QUEUE_DEPTH,segments=1,overlap=DEFAULT_SEGMENT_OVERLAP,preview=None):
     """
     Process a video file and calculate angles for each frame.
 
     Args:
         file (str): Path to the video file.
+        queue_depth (int): Number of decoded frames buffered ahead of the pose inference.
+        segments (int): Number of time segments processed in parallel.
+        overlap (int): Number of frames processed before each segment boundary to warm up the tracking.
+        preview (str): Debug mode: path of an annotated preview video.
 
     Returns:
         dict: Dictionary containing angles for each frame.
     """
-    # Processing code goes here.
-    process = True
-        #Processing of the video 
-    with mp_pose.Pose(min_detection_confidence=0.5,min_tracking_confidence=0.5) as pose:
-        
-        #import the video to process
-        video = cv2.VideoCapture(file)
-        width,height = video.get(cv2.CAP_PROP_FRAME_WIDTH),video.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        n = 33
-        all_poses = {}
-        frame = 0
-        coordinate_system = {}
-
-        while process:
-            success,img = video.read()
-            if success:
-
-                #recolor the image
-                img = cv2.cvtColor(img,cv2.COLOR_BGR2RGB)
-                img.flags.writeable = False
-
-                #detect the pose
-                results = pose.process(img)
-
-                #recolor the image
-                img.flags.writeable = True
-                img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-
-                lmList = np.zeros((n,3))
-
-                #landmark extraction
-                try :
-                    landmarks = results.pose_landmarks.landmark
-                    for i in range(len(landmarks)):
-                        lmList[i,0] = landmarks[i].x*10
-                        lmList[i,1] = landmarks[i].y*10
-                        lmList[i,2] = landmarks[i].z*10/3
-                except : 
-                    pass
-
-                # render detection
-                mp_drawing.draw_landmarks(img,results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
-                                        mp_drawing.DrawingSpec(color=(245,117,66),thickness=2,circle_radius=2),
-                                        mp_drawing.DrawingSpec(color=(245,66,230),thickness=2,circle_radius=2))
-
-                
-                for articulation in ARTICULATIONS:
-                    coordinate_system[articulation] = list(coordinate_system_initialisation(lmList,articulation))
-                #print(frame)
-                #adding each angle of articulation to a dictionnary
-                angle_dict = {}
-                if len(lmList)!=0 :
-                    angle_dict["RightHip"]= angle(lmList,24,coordinate_system)
-                    angle_dict["LeftHip"] = angle(lmList,23,coordinate_system)
-                    angle_dict["RightKnee"] =  angle(lmList,26,coordinate_system)
-                    angle_dict["LeftKnee"] = angle(lmList,25,coordinate_system)
-                    angle_dict["RightAnkle"] = angle(lmList,28,coordinate_system)
-                    angle_dict["LeftAnkle"] = angle(lmList,27,coordinate_system)
-                all_poses[frame] = angle_dict
-                #print(new_lmList)
-                frame += 1
-            else : 
-                process = False
-            #free the windows
-    cv2.destroyAllWindows()
-    video.release()
-    return all_poses
+    landmarks,detected = extract_landmarks(file,queue_depth,segments,overlap,preview=preview)
+    return angles_from_landmarks(landmarks)
@@ -1,7 +1,40 @@
 import numpy as np
 import ast
-from src.pose import Pose
+import os
+import warnings
+from src.pose import DIRECTION,LEAN,ROTATION,Pose,codes_to_string,pack_codes,unpack_codes
 from src.tomatrix import pose_to_matrix
+from src.pose_library import library_exists,load_library
+from src.pose_index import EXACT_SEARCH_MAX_REFERENCES,IVFIndex,index_exists
+from src.temporal import DEFAULT_MIN_SEGMENT_FRAMES,run_lengths,sparse_viterbi_segments,viterbi_segments
+
+# Reference poses used for the classification.
+REFERENCE_FILE = "src/output/angle_for_classification.txt"
+
+# Maximum number of (frame, reference) distances computed at once.
+DISTANCE_BLOCK_SIZE = 1 << 20
+
+# Nearest references of each frame considered by the segmentation.
+SEGMENT_CANDIDATES = 16
+
+# Compiled reference sets, cached per worker process and keyed by file path.
+_references = {}
+
+# Approximate search indexes of the reference sets (None for exact search), keyed by file path.
+_indexes = {}
+
+# Heading of each direction relative to the rotation of the pose, in degrees, positive when the dancer turns to their left.
+DIRECTION_OFFSETS = {"north":0,"northwest":45,"northeast":-45}
+
+# Rotations of the pose grid; 360 is the same heading as 0 and is never returned.
+ROTATIONS = [0,30,60,90,120,150,180,270]
+
+# Leans of the pose grid and their range of torso pitch in degrees (see angle_calculation.pelvis_orientation).
+LEAN_THRESHOLD = 15
+LEANS = {"straight":(-LEAN_THRESHOLD,LEAN_THRESHOLD),"forward":(LEAN_THRESHOLD,np.inf),"backward":(-np.inf,-LEAN_THRESHOLD)}
+
+# Orientation variants of a reference pose: (direction, rotation, lean) and heading in degrees, built once per process.
+_variants = []
 
 def frobenius(mat1,mat2):
 	"""
@@ -15,55 +48,272 @@ def frobenius(mat1,mat2):
         float: Frobenius norm between the matrices.
     """
 	return np.linalg.norm(mat1-mat2,'fro')
-	
-def angle_classification(poses,all_poses):
+
+def parse_pose(descriptor):
+	"""
+    Build a Pose from its descriptor string without calling eval.
+
+    Args:
+        descriptor (str): Descriptor of the pose, e.g. 'Pose("Collected","straight","right","north",3,0,"straight")'.
+
+    Returns:
+        Pose: The decoded pose.
+    """
+	call = ast.parse(descriptor,mode='eval').body
+	return Pose(*[ast.literal_eval(arg) for arg in call.args])
+
+def load_references(path=REFERENCE_FILE):
+	"""
+    Load and compile a reference set once per process.
+    The binary library next to the text file (see pose_library) is memory-mapped when it exists.
+
+    Args:
+        path (str): Path to the reference file.
+
+    Returns:
+        tuple: Descriptors (list), decoded poses (list) and a contiguous (K, 18) matrix of reference angles.
+    """
+	if path not in _references:
+		prefix = os.path.splitext(path)[0]
+		if library_exists(prefix):
+			index,matrix = load_library(prefix)
+			descriptors = index["descriptors"]
+			matrix = matrix.reshape(len(descriptors),18)
+		else:
+			with open(path, 'r') as file:
+				angle_for_classification = ast.literal_eval(file.read())
+			descriptors = list(angle_for_classification.keys())
+			matrix = np.ascontiguousarray([pose_to_matrix(angle_for_classification[d]).ravel() for d in descriptors],dtype=np.float64)
+		poses = [parse_pose(descriptor) for descriptor in descriptors]
+		_references[path] = (descriptors,poses,matrix)
+	return _references[path]
+
+def frames_to_matrix(all_poses):
+	"""
+    Convert the angles of every frame to a (F, 18) matrix.
+
+    Args:
+        all_poses (dict or numpy.array): Dictionary containing angles for each frame, or an (F, 6, 3) array.
+
+    Returns:
+        numpy.array: Matrix of shape (F, 18).
+    """
+	if isinstance(all_poses,dict):
+		if len(all_poses) == 0:
+			return np.zeros((0,18))
+		return np.array([pose_to_matrix(all_poses[frame]).ravel() for frame in sorted(all_poses)])
+	return np.asarray(all_poses,dtype=np.float64).reshape(-1,18)
+
+def distance_blocks(frames,references):
+	"""
+    Compute the Frobenius distances of the frames to the references, a block of at most DISTANCE_BLOCK_SIZE
+    (frame, reference) pairs at a time.
+
+    Args:
+        frames (numpy.array): Frame angles of shape (F, 18).
+        references (numpy.array): Reference angles of shape (K, 18).
+
+    Yields:
+        tuple: Index of the first frame of the block and distances of shape (block, K).
+    """
+	block = max(1,DISTANCE_BLOCK_SIZE // max(1,len(references)))
+	for start in range(0,len(frames),block):
+		yield start,np.linalg.norm(frames[start:start+block,None,:]-references[None,:,:],axis=-1)
+
+def nearest_references(frames,references,k=1):
+	"""
+    Find the k nearest references of every frame by Frobenius distance.
+
+    Args:
+        frames (numpy.array): Frame angles of shape (F, 18).
+        references (numpy.array): Reference angles of shape (K, 18).
+        k (int): Number of neighbours to return.
+
+    Returns:
+        tuple: Indices and distances of the neighbours, both of shape (F, k), closest first.
+    """
+	k = min(k,len(references))
+	indices = np.zeros((len(frames),k),dtype=np.int64)
+	distances = np.zeros((len(frames),k))
+	for start,dist in distance_blocks(frames,references):
+		if k == 1:
+			best = np.argmin(dist,axis=1)[:,None]
+		else:
+			best = np.argpartition(dist,k-1,axis=1)[:,:k]
+			# sort the k candidates, ties resolved by reference order
+			order = np.lexsort((best,np.take_along_axis(dist,best,axis=1)),axis=1)
+			best = np.take_along_axis(best,order,axis=1)
+		indices[start:start+len(dist)] = best
+		distances[start:start+len(dist)] = np.take_along_axis(dist,best,axis=1)
+	return indices,distances
+
+def orientation_variants():
+	"""
+    Precompute the orientation variants that every reference pose can take: each heading of the direction and rotation
+    grid, combined with each lean. Several (direction, rotation) pairs give the same heading, e.g. northwest + 0 and
+    northeast + 90 are both 45 degrees: each heading is kept once, with the pair of the smallest rotation.
+
+    Returns:
+        tuple: (direction, rotation, lean) of each variant (list) and their headings in degrees (numpy.array of shape (V,)).
+    """
+	if not _variants:
+		pairs = {}
+		for rotation in ROTATIONS:
+			for direction in DIRECTION_OFFSETS:
+				pairs.setdefault((rotation+DIRECTION_OFFSETS[direction]) % 360,(direction,rotation))
+		grid = [(direction,rotation,lean) for heading,(direction,rotation) in sorted(pairs.items()) for lean in LEANS]
+		headings = np.array([(rotation+DIRECTION_OFFSETS[direction]) % 360 for direction,rotation,lean in grid],dtype=np.float64)
+		_variants.extend((grid,headings))
+	return _variants[0],_variants[1]
+
+def orientation_costs(yaw,pitch):
+	"""
+    Compute how far the orientation of every frame is from every variant, in degrees: the angle between the heading
+    of the pelvis and the heading of the variant, plus how far the torso pitch is outside the range of the variant lean.
+
+    Args:
+        yaw (numpy.array): Heading of the pelvis of each frame, shape (F,).
+        pitch (numpy.array): Forward lean of the torso of each frame, shape (F,).
+
+    Returns:
+        numpy.array: Costs of shape (F, V), variants ordered as orientation_variants().
+    """
+	grid,headings = orientation_variants()
+	turn = np.abs((np.asarray(yaw,dtype=np.float64)[:,None] - headings[None,:] + 180) % 360 - 180)
+	low = np.array([LEANS[lean][0] for _,_,lean in grid])
+	high = np.array([LEANS[lean][1] for _,_,lean in grid])
+	pitch = np.asarray(pitch,dtype=np.float64)[:,None]
+	return turn + np.maximum(low-pitch,0) + np.maximum(pitch-high,0)
+
+def orient_codes(codes,variants):
+	"""
+    Give pose codes the direction, rotation and lean of orientation variants.
+
+    Args:
+        codes (numpy.array): Integer pose codes of shape (N,), see pose.Pose.code.
+        variants (numpy.array): Index of the variant of each code in orientation_variants(), shape (N,).
+
+    Returns:
+        numpy.array: Integer codes of the oriented poses.
+    """
+	grid,_ = orientation_variants()
+	indices = np.array([(Pose._direction.index(d),Pose._angle.index(r),Pose._lean.index(l)) for d,r,l in grid])
+	fields = unpack_codes(codes)
+	fields[:,[DIRECTION,ROTATION,LEAN]] = indices[variants]
+	return pack_codes(fields)
+
+def reference_index(path=REFERENCE_FILE):
+	"""
+    Load the IVF index of a reference set once per process (see pose_index). Small sets are always searched exactly,
+    and so are sets whose index was built from another version of the library, e.g. regenerated since.
+
+    Args:
+        path (str): Path to the reference file.
+
+    Returns:
+        IVFIndex: The memory-mapped index, or None when the references are searched exactly.
+    """
+	if path not in _indexes:
+		prefix = os.path.splitext(path)[0]
+		descriptors,references,matrix = load_references(path)
+		index = IVFIndex(prefix) if len(matrix) > EXACT_SEARCH_MAX_REFERENCES and index_exists(prefix) else None
+		if index is not None and not index.matches(matrix):
+			warnings.warn(f"The search index of {prefix} does not match the library, rebuild it with python -m src.pose_index {prefix}."
+						  " Falling back to the exact search.")
+			index = None
+		_indexes[path] = index
+	return _indexes[path]
+
+def search_references(frames,path=REFERENCE_FILE,k=1,nprobe=None):
+	"""
+    Find the k nearest references of every frame, through the IVF index of the reference set when it has one.
+
+    Args:
+        frames (numpy.array): Frame angles of shape (F, 18).
+        path (str): Path to the reference file.
+        k (int): Number of neighbours to return.
+        nprobe (int): Number of index lists probed per frame, more is slower with a better recall.
+
+    Returns:
+        tuple: Indices and distances of the neighbours, both of shape (F, k), closest first.
+    """
+	index = reference_index(path)
+	if index is None:
+		return nearest_references(frames,load_references(path)[2],k)
+	return index.search(frames,k,nprobe)
+
+def encode_poses(poses):
+	"""
+    Serialize poses in the format of the save file: 7 digits per pose.
+
+    Args:
+        poses (list): Poses to serialize.
+
+    Returns:
+        str: Serialized representation of the poses.
+    """
+	#Order in the saved file for 1 pose :
+	#Direction
+	#Height
+	#Name
+	#Rotation
+	#Slider
+	#Weighted leg
+	#leaning
+	return codes_to_string(np.array([pose.code for pose in poses],dtype=np.int64))
+
+def angle_classification(poses,all_poses,orientation=None,nprobe=None):
 	"""
     Classify angles based on Frobenius distance and select the best-matching pose.
 
     Args:
         poses (list): List to store the selected poses.
         all_poses (dict): Dictionary containing angles for each frame.
+        orientation (tuple): Yaw and pitch of each frame (see angle_calculation.pelvis_orientation). When given, each pose
+            takes the direction, rotation and lean of the closest orientation variant instead of those of its reference.
+        nprobe (int): Number of index lists probed per frame when the references have an IVF index.
 
     Returns:
         str: Serialized representation of the selected pose.
     """
-	print(f"all_poses = {all_poses}")
-	with open("src/output/angle_for_classification.txt", 'r') as file:
-		angle_for_classification = file.read()
-		angle_for_classification = ast.literal_eval(angle_for_classification)
-		file.close()
-	for frame,value in all_poses.items() :
-		L=[(i,frobenius(pose_to_matrix(all_poses[frame]),pose_to_matrix(angle_for_classification[i]))) for i in angle_for_classification.keys()]
-		print("\n")
-		print(L[0][0])
-		# Code pour exécuter le programme Python avec le fichier d'entrée
-		# Enregistrer le fichier de sortie
-		s=""
-		L.sort(key=lambda x: x[1])
-		for item in L:
-			s+=f'{item[0]}: {item[1]}\n'
-		poses.append(eval(L[0][0]))
-        
-	to_save = ""
-	for pose in poses:
-		
-		#Order in the saved file for 1 pose :
-		#Direction
-		#Height
-		#Name
-		#Rotation
-		#Slider
-		#Weighted leg
-		#leaning
-
-		to_save += str(pose._d)
-		to_save += str(pose.get_height_ind)
-		to_save += str(pose.get_name_ind)
-		to_save += str(pose.get_angle_ind)
-		to_save += str(pose.get_slider_ind) 
-		to_save += str(pose.get_leg_ind)
-		to_save += str(pose.get_lean_ind)
-
-	return to_save
-	
-	
+	descriptors,references,matrix = load_references()
+	indices,_ = search_references(frames_to_matrix(all_poses),nprobe=nprobe)
+	codes = np.array([pose.code for pose in references],dtype=np.int64)[indices[:,0]]
+	if orientation is not None:
+		# the joint angles do not depend on the orientation: the best variant is the best reference in the best orientation
+		codes = orient_codes(codes,np.argmin(orientation_costs(*orientation),axis=1))
+	previous = encode_poses(poses)
+	# poses are shared per code, not allocated per frame
+	poses.extend(Pose.from_code(code) for code in codes.tolist())
+	return previous + codes_to_string(codes)
+
+def segment_classification(all_poses,min_frames=DEFAULT_MIN_SEGMENT_FRAMES,penalty=None,orientation=None,candidates=SEGMENT_CANDIDATES,nprobe=None):
+	"""
+    Split the clip into stable pose intervals instead of classifying every frame on its own.
+    A change of pose is only kept when the new pose fits better over enough frames to pay the switch penalty,
+    which removes the one-frame flickers of the per-frame classification.
+
+    Args:
+        all_poses (dict or numpy.array): Angles of each frame, see frames_to_matrix().
+        min_frames (int): Sets the default penalty to min_frames times the median distance to the nearest reference.
+        penalty (float): Cost of a change of pose, in Frobenius distance.
+        orientation (tuple): Yaw and pitch of each frame (see angle_calculation.pelvis_orientation). When given, the orientation
+            variants are segmented the same way, with a penalty in degrees, and a segment ends when either the pose or its
+            orientation changes.
+        candidates (int): Number of nearest references of each frame the segmentation chooses from, found through the IVF
+            index of the references when they have one. The segmentation is exact when the library has no more references.
+        nprobe (int): Number of index lists probed per frame when the references have an IVF index.
+
+    Returns:
+        list: (Pose, start, end) segments covering the clip, end excluded.
+    """
+	descriptors,references,matrix = load_references()
+	frames = frames_to_matrix(all_poses)
+	indices,distances = search_references(frames,k=candidates,nprobe=nprobe)
+	if penalty is None:
+		penalty = min_frames * float(np.median(distances[:,0])) if len(frames) else 0.0
+	codes = np.array([pose.code for pose in references],dtype=np.int64)[sparse_viterbi_segments(indices,distances,penalty)]
+	if orientation is not None:
+		costs = orientation_costs(*orientation)
+		codes = orient_codes(codes,viterbi_segments(costs,min_frames * max(1.0,float(np.median(costs.min(axis=1)))) if len(costs) else 0.0))
+	return [(Pose.from_code(code),start,end) for code,start,end in run_lengths(codes)]
@@ -1,81 +1,100 @@
-import cv2
-import mediapipe as mp
 import numpy as np
-from flask_socketio import SocketIO,emit
+import struct
+from src.frame_pipeline import DEFAULT_QUEUE_DEPTH
+from src.video_analysis import DEFAULT_SEGMENT_OVERLAP,extract_landmarks
 
-mp_drawing = mp.solutions.drawing_utils
-mp_pose = mp.solutions.pose
+# Binary animation payload: header followed by the landmarks (frames, 33, 3) quantized to int16.
+# Header: magic, version, number of landmarks, fps, number of frames, scale (value = int16 / scale).
+# Landmarks are the raw MediaPipe (x, y, z), the viewer uses (x, 1-y, z) as in animation_from_landmarks().
+ANIMATION_MAGIC = b'VTAN'
+ANIMATION_VERSION = 1
+ANIMATION_HEADER = struct.Struct('<4sBxHfIf')
 
+def encode_animation(landmarks,fps):
+    """
+    Encode landmarks into the binary animation payload.
+
+    Args:
+        landmarks (numpy.array): Landmarks of shape (F, 33, 3) or (F, 33, 4).
+        fps (float): Frame rate of the video.
+
+    Returns:
+        bytes: Binary animation payload.
+    """
+    values = np.asarray(landmarks[...,:3],dtype=np.float64)
+    peak = np.abs(values).max() if values.size else 0
+    scale = 32767 / peak if peak > 0 else 1.0
+    quantized = np.round(values*scale).astype('<i2')
+    header = ANIMATION_HEADER.pack(ANIMATION_MAGIC,ANIMATION_VERSION,values.shape[1],fps,values.shape[0],scale)
+    return header + quantized.tobytes()
+
+def decode_animation(data):
+    """
+    Decode a binary animation payload.
 
-def animation_creation(url):
+    Args:
+        data (bytes): Binary animation payload.
+
+    Returns:
+        tuple: Landmarks of shape (F, 33, 3) and frame rate.
+    """
+    magic,version,n,fps,frames,scale = ANIMATION_HEADER.unpack_from(data)
+    if magic != ANIMATION_MAGIC or version != ANIMATION_VERSION:
+        raise ValueError("Not a version 1 animation payload")
+    quantized = np.frombuffer(data,dtype='<i2',count=frames*n*3,offset=ANIMATION_HEADER.size)
+    return quantized.reshape(frames,n,3) / scale,fps
+
+def slice_animation(data,start=None,stop=None):
+    """
+    Cut a frame range out of a binary animation payload without decoding it.
+
+    Args:
+        data (bytes): Binary animation payload.
+        start (int): First frame, defaults to the beginning.
+        stop (int): Frame after the last one, defaults to the end.
+
+    Returns:
+        bytes: Binary animation payload of the frame range.
+    """
+    magic,version,n,fps,frames,scale = ANIMATION_HEADER.unpack_from(data)
+    start,stop,_ = slice(start,stop).indices(frames)
+    stop = max(start,stop)
+    frame_size = n*3*2
+    body = data[ANIMATION_HEADER.size+start*frame_size:ANIMATION_HEADER.size+stop*frame_size]
+    return ANIMATION_HEADER.pack(magic,version,n,fps,stop-start,scale) + body
+
+
+def animation_from_landmarks(landmarks):
+    """
+    Create animation data from raw MediaPipe landmarks.
+
+    Args:
+        landmarks (numpy.array): Landmarks of shape (F, 33, 3) or (F, 33, 4), as returned by video_analysis.extract_landmarks().
+
+    Returns:
+        list: List of strings containing pose data for animation frames.
+    """
+    posList = []
+    for lmList in np.asarray(landmarks[...,:3],dtype=np.float64).tolist():
+        lmString = ''
+        for lm in lmList:
+            lmString += f'{lm[0]},{(1-lm[1])},{lm[2]},'
+        posList.append(lmString)
+    return posList
+
+def animation_creation(url,queue_depth=DEFAULT_QUEUE_DEPTH,segments=1,overlap=DEFAULT_SEGMENT_OVERLAP):
     """
     Create animation data from a video using pose estimation for modelisation.
     Must adapt for the storage service.
 
     Args:
         url (str): URL of the video to process.
+        queue_depth (int): Number of decoded frames buffered ahead of the pose inference.
+        segments (int): Number of time segments processed in parallel.
+        overlap (int): Number of frames processed before each segment boundary to warm up the tracking.
 
     Returns:
         list: List of strings containing pose data for animation frames.
     """
-    process = True
-    #Processing of the video 
-    with mp_pose.Pose(min_detection_confidence=0.5,min_tracking_confidence=0.5) as pose:
-        #import the video to process
-        try:
-            video = cv2.VideoCapture(url)
-        except:
-            print('No video')
-        n = 33
-        frame = 0
-        length = 1
-        posList = []
-        while process:
-            success,img = video.read()
-            if success:
-                print(frame)
-                #recolor the image
-                img = cv2.cvtColor(img,cv2.COLOR_BGR2RGB)
-                img.flags.writeable = False
-
-                #detect the pose
-                results = pose.process(img)
-
-                #recolor the image
-                img.flags.writeable = True
-                img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-
-                lmList = np.zeros((n,3))
-
-                #landmark extraction
-                try :
-                    landmarks = results.pose_landmarks.landmark
-                    for i in range(len(landmarks)):
-                        lmList[i,0] = landmarks[i].x
-                        lmList[i,1] = landmarks[i].y
-                        lmList[i,2] = landmarks[i].z
-                except : 
-                    pass
-            
-                try :
-                    lmString = ''
-                    for lm in lmList:
-                        
-                        lmString += f'{lm[0]},{(1-lm[1])},{lm[2]},'
-
-                    posList.append(lmString)
-                except:
-                    pass
-            
-
-                # 11,12,13,14,15,16,23-28
-                progress = frame/length * 100
-                frame += 1
-                print(frame)
-
-            else : 
-                process = False
-
-    #free the windows
-    video.release()
-    return posList
+    landmarks,detected = extract_landmarks(url,queue_depth,segments,overlap)
+    return animation_from_landmarks(landmarks)
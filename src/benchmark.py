@@ -0,0 +1,286 @@
+import numpy as np
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from src.angle_calculation import angles_from_landmarks
+from src.angle_classification import angle_classification,load_references,nearest_references
+from src.animation_creation import encode_animation
+from src.landmark_cache import decode_landmarks,encode_landmarks
+from src.pose_index import IVFIndex,build_index
+from src.frame_pipeline import DEFAULT_QUEUE_DEPTH,frame_rate
+from src.video_analysis import N_LANDMARKS,_extract_range,allocate_landmarks
+
+############################################################################################################################################
+################################################################ BENCHMARK  ################################################################
+############################################################################################################################################
+
+# Version of the JSON report layout.
+REPORT_VERSION = 2
+
+# Short clips benchmarked by default (*.mp4, *.mov, *.avi).
+CLIP_FOLDER = "src/input/benchmark"
+
+# Sizes of the synthetic clips, in frames.
+SYNTHETIC_FRAMES = (300,3000)
+
+# Frame rate assumed for the synthetic clips and the recorded landmarks.
+DEFAULT_FPS = 30.0
+
+def synthetic_landmarks(frames,seed=0):
+    """
+    Build a landmark tensor that looks like MediaPipe output: a random standing skeleton jittering over time.
+
+    Args:
+        frames (int): Number of frames.
+        seed (int): Seed of the random generator, so that runs are comparable.
+
+    Returns:
+        tuple: Landmarks of shape (frames, 33, 4) in float32 and detection mask of shape (frames,).
+    """
+    rng = np.random.default_rng(seed)
+    landmarks,detected = allocate_landmarks(frames)
+    skeleton = np.column_stack((rng.uniform(0.4,0.6,N_LANDMARKS),np.linspace(0.1,0.9,N_LANDMARKS),rng.normal(0,0.1,N_LANDMARKS)))
+    drift = np.cumsum(rng.normal(0,0.002,(frames,N_LANDMARKS,3)),axis=0)
+    landmarks[...,:3] = skeleton + drift
+    landmarks[...,3] = 1
+    detected[:] = True
+    return landmarks,detected
+
+def peak_allocated(function,*args):
+    """
+    Measure the memory a call allocates on top of what is already allocated, unlike the peak resident set size of the
+    process which never goes down and so only reflects the largest case run so far. Allocations made by native libraries
+    outside of Python and NumPy (e.g. MediaPipe) are not counted.
+
+    Args:
+        function (callable): Function called with args.
+
+    Returns:
+        int: Peak of the memory allocated during the call, in bytes.
+    """
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def _timed(stages,name,function,*args):
+    start = time.perf_counter()
+    result = function(*args)
+    stages[name] = stages.get(name,0.0) + time.perf_counter() - start
+    return result
+
+def analyse_landmarks(landmarks,fps,stages):
+    """
+    Run the stages that follow the pose inference: angle math, classification and serialization of the results.
+    Needs neither OpenCV nor MediaPipe.
+
+    Args:
+        landmarks (numpy.array): Landmarks of shape (F, 33, 4).
+        fps (float): Frame rate of the clip.
+        stages (dict): Time of each stage in seconds, updated in place.
+
+    Returns:
+        dict: Size in bytes of each output.
+    """
+    all_poses = _timed(stages,"angles",angles_from_landmarks,landmarks)
+    classification = _timed(stages,"classification",angle_classification,[],all_poses)
+    animation = _timed(stages,"serialization",encode_animation,landmarks,fps)
+    return {"classification":len(classification.encode()),"animation":len(animation)}
+
+def infer_clip(path,stages):
+    """
+    Run the stages that need OpenCV and MediaPipe on a clip through the production pipeline: decoding, colour conversion and
+    pose inference. Decoding and colour conversion overlap the inference in their own thread, so the sum of the stage
+    times is more than the time taken by the clip.
+
+    Args:
+        path (str): Path of the clip.
+        stages (dict): Time of each stage in seconds, updated in place.
+
+    Returns:
+        tuple: Landmarks of shape (F, 33, 4), detection mask of shape (F,) and frame rate.
+    """
+    landmarks,detected = _extract_range(path,DEFAULT_QUEUE_DEPTH,stages=stages)
+    return landmarks,detected,frame_rate(path) or DEFAULT_FPS
+
+def run_case(name,repeat,landmarks=None,fps=DEFAULT_FPS,clip=None,record=None):
+    """
+    Benchmark one case, either a clip run through the whole pipeline or a landmark tensor run through the stages after the inference.
+    Each stage keeps its fastest time over the repetitions. The memory is measured on one more run, not timed since tracing
+    the allocations slows it down.
+
+    Args:
+        name (str): Name of the case in the report.
+        repeat (int): Number of repetitions.
+        landmarks (numpy.array): Landmarks injected instead of running the pose inference.
+        fps (float): Frame rate of the injected landmarks.
+        clip (str): Path of a clip, used when no landmarks are given.
+        record (str): Path of an .npz file where the landmarks inferred from the clip are saved, to be injected in later runs.
+
+    Returns:
+        dict: Report of the case.
+    """
+    def run(stages):
+        nonlocal landmarks,fps,record
+        if clip is not None:
+            landmarks,detected,fps = infer_clip(clip,stages)
+            if record is not None:
+                with open(record,"wb") as file:
+                    file.write(encode_landmarks(landmarks,detected))
+                record = None
+        return analyse_landmarks(landmarks,fps,stages)
+
+    best = {}
+    for _ in range(max(1,repeat)):
+        stages = {}
+        sizes = run(stages)
+        for stage,seconds in stages.items():
+            best[stage] = min(seconds,best.get(stage,seconds))
+    total = sum(best.values())
+    return {"name":name,"frames":len(landmarks),"stages":best,"total":total,
+            "fps":len(landmarks)/total if total > 0 else None,"peak_allocated":peak_allocated(run,{}),"output_bytes":sizes}
+
+def _commit():
+    try:
+        return subprocess.run(["git","rev-parse","HEAD"],capture_output=True,text=True,check=True).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(clips=(),landmark_files=(),synthetic=SYNTHETIC_FRAMES,repeat=3,record_folder=None):
+    """
+    Benchmark the synthetic tensors, the recorded landmark files and the clips.
+
+    Args:
+        clips (list): Paths of the clips, run through the whole pipeline (needs OpenCV and MediaPipe).
+        landmark_files (list): Paths of recorded landmarks (.npz written by landmark_cache.encode_landmarks()).
+        synthetic (list): Sizes in frames of the synthetic landmark tensors.
+        repeat (int): Number of repetitions of each case.
+        record_folder (str): Folder where the landmarks inferred from the clips are saved, named after the clips.
+
+    Returns:
+        dict: Machine-readable report, see compare_reports().
+    """
+    # the reference poses are loaded once per worker process, not per video
+    load_references()
+    cases = []
+    for frames in synthetic:
+        landmarks,_ = synthetic_landmarks(frames)
+        cases.append(run_case(f"synthetic_{frames}",repeat,landmarks))
+    for path in landmark_files:
+        with open(path,"rb") as file:
+            landmarks,_ = decode_landmarks(file.read())
+        cases.append(run_case(os.path.basename(path),repeat,landmarks))
+    for path in clips:
+        record = None
+        if record_folder is not None:
+            os.makedirs(record_folder,exist_ok=True)
+            record = os.path.join(record_folder,f"{os.path.splitext(os.path.basename(path))[0]}.npz")
+        cases.append(run_case(os.path.basename(path),repeat,clip=path,record=record))
+    return {"version":REPORT_VERSION,"commit":_commit(),"timestamp":time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python":platform.python_version(),"numpy":np.__version__,"machine":platform.machine(),"cases":cases}
+
+def benchmark_index(references=20000,frames=5400,nprobes=(1,2,4,8,16),lists=None,seed=0):
+    """
+    Compare the IVF index of a large synthetic library with the exact search: recall of the nearest reference and latency.
+    The library spreads variations around the real references, and the frames are noisy copies of library poses.
+
+    Args:
+        references (int): Number of references of the synthetic library.
+        frames (int): Number of frames searched.
+        nprobes (list): Numbers of lists probed per frame.
+        lists (int): Number of lists of the index, defaults to about the square root of the library size.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        dict: Report with the exact search and one entry per nprobe.
+    """
+    rng = np.random.default_rng(seed)
+    base = np.asarray(load_references()[2])
+    library = base[rng.integers(len(base),size=references)] + rng.normal(0,20,(references,base.shape[1]))
+    queries = library[rng.integers(references,size=frames)] + rng.normal(0,10,(frames,base.shape[1]))
+    folder = tempfile.mkdtemp()
+    try:
+        prefix = os.path.join(folder,"library")
+        start = time.perf_counter()
+        build_index(prefix,library,lists)
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        exact,_ = nearest_references(queries,library)
+        exact_time = time.perf_counter() - start
+        index = IVFIndex(prefix)
+        results = []
+        for nprobe in nprobes:
+            start = time.perf_counter()
+            found,_ = index.search(queries,1,nprobe)
+            seconds = time.perf_counter() - start
+            results.append({"nprobe":nprobe,"recall":float(np.mean(found[:,0] == exact[:,0])),"seconds":seconds,
+                            "speedup":exact_time/seconds if seconds > 0 else None})
+        return {"references":references,"frames":frames,"lists":len(index.centroids),"build_seconds":build_time,
+                "exact_seconds":exact_time,"ivf":results}
+    finally:
+        shutil.rmtree(folder)
+
+def compare_reports(baseline,report):
+    """
+    Compare two reports case by case.
+
+    Args:
+        baseline (dict): Report of the reference commit.
+        report (dict): Report of the current commit.
+
+    Returns:
+        list: Lines "case stage baseline current ratio", ratio > 1 meaning slower than the baseline.
+    """
+    previous = {case["name"]:case for case in baseline["cases"]}
+    lines = []
+    for case in report["cases"]:
+        old = previous.get(case["name"])
+        if old is None:
+            continue
+        for stage,seconds in list(case["stages"].items()) + [("total",case["total"])]:
+            before = old["stages"].get(stage) if stage != "total" else old["total"]
+            if before:
+                lines.append(f"{case['name']:<24} {stage:<16} {before:10.4f}s {seconds:10.4f}s {seconds/before:6.2f}x")
+    return lines
+
+if __name__=='__main__':
+
+    # python -m src.benchmark --output bench.json
+    # python -m src.benchmark --no-clips --landmarks cache/landmarks/*.npz --baseline bench.json
+    parser = argparse.ArgumentParser(description="Benchmark the video analysis and classification pipeline.")
+    parser.add_argument("--clips",nargs="*",default=None,help=f"clips run through the whole pipeline, defaults to {CLIP_FOLDER}")
+    parser.add_argument("--no-clips",action="store_true",help="only run the stages after the inference, without MediaPipe")
+    parser.add_argument("--landmarks",nargs="*",default=[],help="recorded landmarks (.npz) injected instead of the inference")
+    parser.add_argument("--synthetic",nargs="*",type=int,default=list(SYNTHETIC_FRAMES),help="frames of the synthetic tensors")
+    parser.add_argument("--repeat",type=int,default=3,help="repetitions of each case, the fastest is kept")
+    parser.add_argument("--record",default=None,help="folder where the landmarks of the clips are saved for later injection")
+    parser.add_argument("--output",default=None,help="JSON report path, defaults to stdout")
+    parser.add_argument("--baseline",default=None,help="JSON report of another commit to compare with")
+    parser.add_argument("--ann",type=int,default=0,help="also compare the IVF index with the exact search on a library of this size")
+    args = parser.parse_args()
+
+    clips = [] if args.no_clips else args.clips
+    if clips is None:
+        clips = sorted(path for pattern in ("*.mp4","*.mov","*.avi") for path in glob.glob(os.path.join(CLIP_FOLDER,pattern)))
+    report = run_benchmark(clips,args.landmarks,args.synthetic,args.repeat,args.record)
+    if args.ann:
+        report["ann"] = benchmark_index(args.ann)
+    if args.output is None:
+        print(json.dumps(report,indent=1))
+    else:
+        with open(args.output,"w") as file:
+            json.dump(report,file,indent=1)
+    if args.baseline is not None:
+        with open(args.baseline,"r") as file:
+            for line in compare_reports(json.load(file),report):
+                print(line,file=sys.stderr)
@@ -0,0 +1,206 @@
+import queue
+import threading
+import time
+from src.metrics import metrics
+
+# cv2 is imported in the functions so that the web process, which only imports this module, starts without OpenCV.
+
+############################################################################################################################################
+################################################################ FRAME PIPELINE  ###########################################################
+############################################################################################################################################
+
+# Default number of decoded frames buffered between the decoding thread and the pose inference.
+DEFAULT_QUEUE_DEPTH = 8
+
+# Marks the end of the video in the queue.
+_END = object()
+
+# Size of the downscaled grey frames compared in adaptive sampling.
+DIFF_SIZE = (64,36)
+
+def sampling_stride(fps,stride=1,target_fps=None):
+    """
+    Args:
+        fps (float): Frame rate of the video, 0 when unknown.
+        stride (int): Requested stride.
+        target_fps (float): Requested sampling rate, overrides stride when the frame rate is known.
+
+    Returns:
+        int: Number of frames between two sampled frames.
+    """
+    if target_fps and fps > 0:
+        return max(1,int(round(fps/target_fps)))
+    return max(1,int(stride))
+
+def _decode(source,frames,stop,start,count,stride,target_fps,threshold,stages):
+    """
+    Producer: decode the video, convert each frame to RGB and push it to the queue.
+    Frames left out by the sampling are pushed as None so that the frame indices stay aligned.
+    Blocks when the queue is full, until the consumer catches up or stops.
+
+    Args:
+        source (str): Path or URL of the video.
+        frames (queue.Queue): Bounded queue shared with the consumer.
+        stop (threading.Event): Set by the consumer when it stops reading.
+        start (int): Index of the first frame to decode.
+        count (int): Maximum number of frames to decode, None for all of them.
+        stride (int): Only every stride-th frame of the video is sampled.
+        target_fps (float): Sampling rate, overrides stride when the video frame rate is known.
+        threshold (float): Adaptive sampling: skip frames whose mean grey-level difference with the last sampled frame is below it.
+        stages (dict): Time of the decode and colour stages in seconds, updated in place. Not updated when None.
+    """
+    import cv2
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                frames.put(item,timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    # stage times are summed locally and recorded once
+    decode_time = colour_time = 0.0
+    decoded_frames = colour_frames = 0
+    video = cv2.VideoCapture(source)
+    try:
+        if start > 0:
+            video.set(cv2.CAP_PROP_POS_FRAMES,start)
+        stride = sampling_stride(video.get(cv2.CAP_PROP_FPS),stride,target_fps)
+        decoded = 0
+        last = None
+        while not stop.is_set() and (count is None or decoded < count):
+            # the first frame is always sampled, skipped frames are not decoded
+            if decoded > 0 and (start+decoded) % stride != 0:
+                tic = time.perf_counter()
+                grabbed = video.grab()
+                decode_time += time.perf_counter() - tic
+                if not grabbed:
+                    break
+                if not put(None):
+                    break
+                decoded += 1
+                continue
+            tic = time.perf_counter()
+            success,img = video.read()
+            decode_time += time.perf_counter() - tic
+            if not success:
+                break
+            decoded_frames += 1
+            if threshold is not None:
+                small = cv2.resize(cv2.cvtColor(img,cv2.COLOR_BGR2GRAY),DIFF_SIZE,interpolation=cv2.INTER_AREA)
+                if last is not None and cv2.absdiff(small,last).mean() < threshold:
+                    img = None
+                else:
+                    last = small
+            if img is not None:
+                tic = time.perf_counter()
+                img = cv2.cvtColor(img,cv2.COLOR_BGR2RGB)
+                colour_time += time.perf_counter() - tic
+                colour_frames += 1
+                img.flags.writeable = False
+            if not put(img):
+                break
+            decoded += 1
+    except Exception as e:
+        put(e)
+    finally:
+        video.release()
+        metrics.observe("stage",decode_time,decoded_frames,stage="decode")
+        metrics.observe("stage",colour_time,colour_frames,stage="colour")
+        if stages is not None:
+            stages["decode"] = stages.get("decode",0.0) + decode_time
+            stages["colour"] = stages.get("colour",0.0) + colour_time
+        put(_END)
+
+def read_frames(source,queue_depth=DEFAULT_QUEUE_DEPTH,start=0,stop=None,stride=1,target_fps=None,threshold=None,stages=None):
+    """
+    Read the frames of a video, decoded and converted to RGB in a separate thread.
+    Decoding of the next frames overlaps with the processing of the current one.
+    Every frame index is yielded; the image is None for frames left out by the sampling.
+
+    Args:
+        source (str): Path or URL of the video.
+        queue_depth (int): Maximum number of decoded frames waiting to be processed.
+        start (int): Index of the first frame to read, reached by seeking.
+        stop (int): Index after the last frame to read, None to read until the end.
+        stride (int): Only every stride-th frame of the video is sampled.
+        target_fps (float): Sampling rate, overrides stride when the video frame rate is known.
+        threshold (float): Adaptive sampling: skip frames whose mean grey-level difference (0-255) with the last sampled frame is below it.
+        stages (dict): Time of the decode and colour stages in seconds, updated in place once the reading ends.
+
+    Yields:
+        tuple: Frame index and read-only RGB image, or None when the frame is not sampled.
+    """
+    frames = queue.Queue(maxsize=max(1,queue_depth))
+    count = None if stop is None else max(0,stop-start)
+    halt = threading.Event()
+    producer = threading.Thread(target=_decode,args=(source,frames,halt,start,count,max(1,int(stride)),target_fps,threshold,stages),daemon=True)
+    producer.start()
+    frame = start
+    try:
+        while True:
+            img = frames.get()
+            if img is _END:
+                break
+            if isinstance(img,Exception):
+                raise img
+            yield frame,img
+            frame += 1
+    finally:
+        halt.set()
+        producer.join()
+
+def frame_rate(source):
+    """
+    Read the frame rate of a video.
+
+    Args:
+        source (str): Path or URL of the video.
+
+    Returns:
+        float: Frames per second, 0 when unknown.
+    """
+    import cv2
+    video = cv2.VideoCapture(source)
+    try:
+        return max(0.0,float(video.get(cv2.CAP_PROP_FPS)))
+    finally:
+        video.release()
+
+def frame_count(source):
+    """
+    Read the number of frames announced by the container of a video.
+    The value comes from the metadata and can be approximate for some codecs.
+
+    Args:
+        source (str): Path or URL of the video.
+
+    Returns:
+        int: Number of frames, 0 when unknown.
+    """
+    import cv2
+    video = cv2.VideoCapture(source)
+    try:
+        return max(0,int(video.get(cv2.CAP_PROP_FRAME_COUNT)))
+    finally:
+        video.release()
+
+def video_duration(source):
+    """
+    Estimate the duration of a video from the frame count and frame rate of its container, without decoding it.
+
+    Args:
+        source (str): Path or URL of the video.
+
+    Returns:
+        float: Duration in seconds, 0 when unknown.
+    """
+    import cv2
+    video = cv2.VideoCapture(source)
+    try:
+        frames,fps = video.get(cv2.CAP_PROP_FRAME_COUNT),video.get(cv2.CAP_PROP_FPS)
+        return max(0.0,float(frames)/fps) if fps > 0 else 0.0
+    finally:
+        video.release()
@@ -0,0 +1,223 @@
+import numpy as np
+import hashlib
+import io
+import json
+import os
+import time
+
+############################################################################################################################################
+################################################################ CACHE KEYS  ###############################################################
+############################################################################################################################################
+
+def content_key(path,settings):
+    """
+    Compute the cache key of a video: hash of its bytes and of the pose estimation settings.
+
+    Args:
+        path (str): Path to the video file.
+        settings (dict): Settings of the pose estimation (min_detection_confidence, min_tracking_confidence, model_complexity).
+
+    Returns:
+        str: Hexadecimal SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    with open(path,'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20),b''):
+            digest.update(chunk)
+    digest.update(json.dumps(settings,sort_keys=True).encode())
+    return digest.hexdigest()
+
+def encode_landmarks(landmarks,detected):
+    """
+    Serialize a landmark tensor and its detection mask to compressed bytes.
+
+    Args:
+        landmarks (numpy.array): Landmark tensor.
+        detected (numpy.array): Detection mask.
+
+    Returns:
+        bytes: Compressed npz payload.
+    """
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer,landmarks=landmarks,detected=detected)
+    return buffer.getvalue()
+
+def decode_landmarks(data):
+    """
+    Deserialize a landmark tensor written by encode_landmarks().
+
+    Args:
+        data (bytes): Compressed npz payload.
+
+    Returns:
+        tuple: Landmark tensor and detection mask.
+    """
+    with np.load(io.BytesIO(data)) as payload:
+        return payload['landmarks'],payload['detected']
+
+
+############################################################################################################################################
+################################################################ BACKENDS  #################################################################
+############################################################################################################################################
+
+class DirectoryBackend:
+    """
+    Stores cache entries as files in a local folder.
+    The modification time of a file is its last access, used for both the TTL and the LRU eviction.
+
+    Attributes:
+        folder (str): Folder holding the entries.
+        max_bytes (int): Maximum total size of the entries.
+        ttl (int): Time in seconds after which an unused entry expires.
+    """
+    def __init__(self,folder,max_bytes,ttl):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def _path(self,key):
+        return os.path.join(self.folder,f"{key}.npz")
+
+    def get(self,key):
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path,'rb') as file:
+                data = file.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def set(self,key,data):
+        os.makedirs(self.folder,exist_ok=True)
+        path = self._path(key)
+        # write then rename so that a concurrent reader never sees a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path,'wb') as file:
+            file.write(data)
+        os.replace(temp_path,path)
+        self.evict()
+
+    def evict(self):
+        """
+        Remove expired entries, then the least recently used ones until the folder fits in max_bytes.
+        """
+        entries = []
+        now = time.time()
+        for filename in os.listdir(self.folder):
+            if not filename.endswith('.npz'):
+                continue
+            path = os.path.join(self.folder,filename)
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime > self.ttl:
+                    os.remove(path)
+                else:
+                    entries.append((stat.st_mtime,stat.st_size,path))
+            except FileNotFoundError:
+                pass
+        total = sum(size for _,size,_ in entries)
+        for _,size,path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+class RedisBackend:
+    """
+    Stores cache entries in Redis with an expiry.
+    A sorted set keeps the last access of each entry for the LRU eviction and a hash keeps their sizes.
+
+    Attributes:
+        connection (redis.StrictRedis): Redis connection.
+        max_bytes (int): Maximum total size of the entries.
+        ttl (int): Time in seconds after which an unused entry expires.
+        prefix (str): Prefix of the Redis keys.
+    """
+    def __init__(self,connection,max_bytes,ttl,prefix='landmarks'):
+        self.connection = connection
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self,key):
+        name = f"{self.prefix}:{key}"
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.get(name)
+        pipe.expire(name,self.ttl)
+        pipe.zadd(f"{self.prefix}:lru",{key:time.time()},xx=True)
+        return pipe.execute()[0]
+
+    def set(self,key,data):
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.set(f"{self.prefix}:{key}",data,ex=self.ttl)
+        pipe.zadd(f"{self.prefix}:lru",{key:time.time()})
+        pipe.hset(f"{self.prefix}:sizes",key,len(data))
+        pipe.execute()
+        self.evict()
+
+    def evict(self):
+        """
+        Forget expired entries, then remove the least recently used ones until the total fits in max_bytes.
+        """
+        sizes = {k.decode():int(v) for k,v in self.connection.hgetall(f"{self.prefix}:sizes").items()}
+        keys = [k.decode() for k in self.connection.zrange(f"{self.prefix}:lru",0,-1)]
+        pipe = self.connection.pipeline(transaction=False)
+        for key in keys:
+            pipe.exists(f"{self.prefix}:{key}")
+        alive = pipe.execute()
+        total = sum(sizes.get(key,0) for key,exists in zip(keys,alive) if exists)
+        removed = []
+        for key,exists in zip(keys,alive):
+            if exists and total <= self.max_bytes:
+                continue
+            if exists:
+                total -= sizes.get(key,0)
+            removed.append(key)
+        if removed:
+            pipe = self.connection.pipeline(transaction=False)
+            pipe.delete(*[f"{self.prefix}:{key}" for key in removed])
+            pipe.zrem(f"{self.prefix}:lru",*removed)
+            pipe.hdel(f"{self.prefix}:sizes",*removed)
+            pipe.execute()
+
+
+############################################################################################################################################
+################################################################ LANDMARK CACHE  ###########################################################
+############################################################################################################################################
+
+class LandmarkCache:
+    """
+    Content-addressed cache of the landmark tensors extracted from videos.
+
+    Attributes:
+        backend (DirectoryBackend or RedisBackend): Storage of the compressed tensors.
+    """
+    def __init__(self,backend):
+        self.backend = backend
+
+    def get(self,key):
+        """
+        Args:
+            key (str): Cache key, see content_key().
+
+        Returns:
+            tuple: The cached landmarks and detection mask, or None on a miss.
+        """
+        data = self.backend.get(key)
+        return None if data is None else decode_landmarks(data)
+
+    def set(self,key,landmarks,detected):
+        """
+        Args:
+            key (str): Cache key, see content_key().
+            landmarks (numpy.array): Landmarks to store.
+            detected (numpy.array): Detection mask of the landmarks.
+        """
+        self.backend.set(key,encode_landmarks(landmarks,detected))
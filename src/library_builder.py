@@ -0,0 +1,230 @@
+import numpy as np
+import argparse
+import glob
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor,as_completed
+from src.angle_calculation import angles_from_landmarks
+from src.angle_classification import frames_to_matrix,parse_pose
+from src.landmark_cache import content_key
+from src.pose_index import build_index,index_exists
+from src.pose_library import library_exists,load_library,save_library
+from src.video_analysis import POSE_SETTINGS,extract_landmarks
+
+############################################################################################################################################
+################################################################ LIBRARY BUILDER  ##########################################################
+############################################################################################################################################
+
+# Library written by default, the one loaded by the classification.
+DEFAULT_LIBRARY = "src/output/angle_for_classification"
+
+# Descriptors of the poses, one per line. A clip named after a line number (1.mp4, 012.mov...) is a clip of that pose.
+DEFAULT_NAMES = "src/input/pose_names.txt"
+
+# Extensions of the reference clips.
+CLIP_EXTENSIONS = (".mp4",".mov",".avi",".mkv",".webm")
+
+# Fraction of the detected frames kept as stable: those where the angles move the least.
+STABLE_FRACTION = 0.5
+
+# Maximum number of stable frames compared with each other to find the medoid.
+MEDOID_SAMPLE = 500
+
+def read_names(path):
+    """
+    Args:
+        path (str): Path of the pose names file.
+
+    Returns:
+        list: Descriptor of each line, e.g. 'Pose("Collected","straight","right","north",3,0,"straight")'.
+    """
+    with open(path,"r") as file:
+        return [line.strip() for line in file if line.strip()]
+
+def slug(descriptor):
+    """
+    Args:
+        descriptor (str): Descriptor of a pose.
+
+    Returns:
+        str: File name stem of the clips of the pose, e.g. 'collected_straight_right_north_3_0_straight'.
+    """
+    return re.sub(r"[^a-z0-9]+","_",descriptor.lower().replace("pose(","",1)).strip("_")
+
+def find_clips(folder,names):
+    """
+    Match the clips of a folder with their pose. A clip is named either after the line number of its pose in the names
+    file (starting at 1) or after the slug of its descriptor.
+
+    Args:
+        folder (str): Folder of the reference clips.
+        names (list): Descriptors of the poses, see read_names().
+
+    Returns:
+        tuple: (clip, descriptor) pairs and clips that match no pose.
+    """
+    slugs = {slug(descriptor):descriptor for descriptor in names}
+    matched,unknown = [],[]
+    for path in sorted(glob.glob(os.path.join(folder,"*"))):
+        stem,extension = os.path.splitext(os.path.basename(path))
+        if extension.lower() not in CLIP_EXTENSIONS:
+            continue
+        if stem.isdigit() and 1 <= int(stem) <= len(names):
+            matched.append((path,names[int(stem)-1]))
+        elif stem.lower() in slugs:
+            matched.append((path,slugs[stem.lower()]))
+        else:
+            unknown.append(path)
+    return matched,unknown
+
+def stable_frames(angles,detected,fraction=STABLE_FRACTION):
+    """
+    Select the frames where the dancer holds the pose: detected frames where the angles change the least.
+
+    Args:
+        angles (numpy.array): Angles of each frame, shape (F, 18).
+        detected (numpy.array): Detection mask of shape (F,).
+        fraction (float): Fraction of the detected frames kept.
+
+    Returns:
+        numpy.array: Indices of the stable frames.
+    """
+    frames = np.flatnonzero(detected)
+    if len(frames) <= 2:
+        return frames
+    # angular speed, wrapped so that a jump from 179 to -179 degrees counts as 2 degrees
+    step = np.abs((np.diff(angles[frames],axis=0) + 180) % 360 - 180).sum(axis=1)
+    speed = np.r_[step[0],np.minimum(step[:-1],step[1:]),step[-1]]
+    keep = max(1,int(round(len(frames)*fraction)))
+    return np.sort(frames[np.argsort(speed,kind="stable")[:keep]])
+
+def aggregate(angles,method="medoid"):
+    """
+    Summarise the stable frames of a clip into one reference.
+
+    Args:
+        angles (numpy.array): Angles of the stable frames, shape (S, 18).
+        method (str): 'medoid' keeps the frame closest to all the others, 'mean' takes the circular mean of each angle.
+
+    Returns:
+        numpy.array: Reference angles of shape (18,).
+    """
+    if method == "mean":
+        radians = np.radians(angles)
+        mean = np.degrees(np.arctan2(np.sin(radians).mean(axis=0),np.cos(radians).mean(axis=0)))
+        return np.where(mean >= 180,mean-360,mean)
+    if method != "medoid":
+        raise ValueError(f"Unknown aggregation method {method}")
+    sample = angles[np.linspace(0,len(angles)-1,min(len(angles),MEDOID_SAMPLE)).astype(int)]
+    difference = np.abs((sample[:,None,:] - sample[None,:,:] + 180) % 360 - 180)
+    return sample[np.argmin(np.linalg.norm(difference,axis=-1).sum(axis=1))]
+
+def process_clip(job):
+    """
+    Extract the reference angles of one clip. Top-level function so that it can be sent to a worker process.
+
+    Args:
+        job (tuple): Path of the clip, descriptor of its pose and aggregation method.
+
+    Returns:
+        tuple: Path, descriptor, reference angles of shape (6, 3) and number of stable frames used.
+    """
+    path,descriptor,method = job
+    landmarks,detected = extract_landmarks(path)
+    if not detected.any():
+        raise ValueError(f"No pose detected in {path}")
+    angles = frames_to_matrix(angles_from_landmarks(landmarks))
+    frames = stable_frames(angles,detected)
+    return path,descriptor,aggregate(angles[frames],method).reshape(6,3),len(frames)
+
+def _fingerprint(path,method):
+    return content_key(path,dict(POSE_SETTINGS,method=method,stable_fraction=STABLE_FRACTION))
+
+def build_library(folder,prefix=DEFAULT_LIBRARY,names_path=DEFAULT_NAMES,method="medoid",workers=None,rebuild=False,log=print):
+    """
+    Build or update the reference library from a folder of labelled clips, processing the clips in parallel.
+    Only clips that are new or changed since the last build are processed. The library is written after each clip,
+    so an interrupted build keeps the poses already done.
+    The clip fingerprints are kept in <prefix>.sources.json.
+
+    Args:
+        folder (str): Folder of the reference clips, see find_clips().
+        prefix (str): Path of the binary library without extension.
+        names_path (str): Path of the pose names file.
+        method (str): Aggregation of the stable frames, see aggregate().
+        workers (int): Number of processes, defaults to the number of CPUs.
+        rebuild (bool): Process every clip, even unchanged ones, and start from an empty library.
+        log (callable): Receives the progress messages.
+
+    Returns:
+        int: Number of poses in the library.
+    """
+    names = read_names(names_path)
+    clips,unknown = find_clips(folder,names)
+    for path in unknown:
+        log(f"skipped {path}: no pose with this number or name")
+    valid = []
+    for path,descriptor in clips:
+        try:
+            parse_pose(descriptor)
+            valid.append((path,descriptor))
+        except (ValueError,SyntaxError) as e:
+            log(f"skipped {path}: invalid descriptor {descriptor} ({e})")
+
+    library = {}
+    if library_exists(prefix) and not rebuild:
+        index,matrix = load_library(prefix)
+        library = {descriptor:np.array(row) for descriptor,row in zip(index["descriptors"],matrix)}
+    sources = {}
+    if os.path.exists(f"{prefix}.sources.json") and not rebuild:
+        with open(f"{prefix}.sources.json","r") as file:
+            sources = json.load(file)
+
+    jobs = []
+    fingerprints = {}
+    for path,descriptor in valid:
+        fingerprints[path] = _fingerprint(path,method)
+        if sources.get(descriptor,{}).get("fingerprint") == fingerprints[path] and descriptor in library:
+            continue
+        jobs.append((path,descriptor,method))
+    log(f"{len(jobs)} clips to process, {len(valid)-len(jobs)} unchanged")
+
+    def write():
+        descriptors = list(library)
+        save_library(prefix,descriptors,np.array([library[d] for d in descriptors]).reshape(len(descriptors),6,3),"angle")
+        with open(f"{prefix}.sources.json","w") as file:
+            json.dump(sources,file,indent=1,sort_keys=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_clip,job) for job in jobs]
+        for future in as_completed(futures):
+            try:
+                path,descriptor,reference,stable = future.result()
+            except Exception as e:
+                log(f"failed: {e}")
+                continue
+            library[descriptor] = reference
+            sources[descriptor] = {"clip":os.path.basename(path),"fingerprint":fingerprints[path],"stable_frames":stable}
+            write()
+            log(f"{descriptor} <- {path} ({stable} stable frames)")
+    # the approximate search index no longer matches the library
+    if jobs and index_exists(prefix):
+        index,matrix = load_library(prefix)
+        build_index(prefix,matrix)
+        log(f"rebuilt the search index of {prefix}")
+    return len(library)
+
+if __name__=='__main__':
+
+    # python -m src.library_builder clips/ --workers 4
+    parser = argparse.ArgumentParser(description="Build the reference pose library from a folder of labelled clips.")
+    parser.add_argument("folder",help="folder of the clips, named after the line number of their pose in the names file")
+    parser.add_argument("--library",default=DEFAULT_LIBRARY,help="path of the binary library without extension")
+    parser.add_argument("--names",default=DEFAULT_NAMES,help="pose names file")
+    parser.add_argument("--method",choices=("medoid","mean"),default="medoid",help="aggregation of the stable frames")
+    parser.add_argument("--workers",type=int,default=None,help="number of processes")
+    parser.add_argument("--rebuild",action="store_true",help="process every clip and start from an empty library")
+    args = parser.parse_args()
+    count = build_library(args.folder,args.library,args.names,args.method,args.workers,args.rebuild)
+    print(f"{count} poses in {args.library}.npy")
@@ -0,0 +1,156 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+############################################################################################################################################
+################################################################ METRICS  ##################################################################
+############################################################################################################################################
+
+# Prefix of the exported metric names.
+NAMESPACE = "visualtango"
+
+# Metrics are counters keyed by name and labels, e.g. ("stage_seconds_total", (("stage","decode"),)).
+# Timers add the elapsed time to <name>_seconds_total and count the calls in <name>_calls_total,
+# so that averages and rates can be derived from two counters.
+
+class Metrics:
+    """
+    Thread-safe counters of a process. Hot loops should accumulate locally and add their totals once.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self,name,value=1,**labels):
+        """
+        Args:
+            name (str): Name of the counter, without the namespace.
+            value (float): Amount to add.
+            **labels: Labels of the counter, e.g. stage="decode".
+        """
+        key = (name,tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key,0) + value
+
+    def observe(self,name,seconds,calls=1,**labels):
+        """
+        Record the time spent in an operation.
+
+        Args:
+            name (str): Name of the timer, without the namespace.
+            seconds (float): Time spent.
+            calls (int): Number of calls the time covers.
+            **labels: Labels of the timer.
+        """
+        self.inc(f"{name}_seconds_total",seconds,**labels)
+        self.inc(f"{name}_calls_total",calls,**labels)
+
+    @contextmanager
+    def timer(self,name,**labels):
+        """
+        Time the enclosed block, see observe().
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name,time.perf_counter()-start,**labels)
+
+    def snapshot(self,reset=False):
+        """
+        Args:
+            reset (bool): Clear the counters, so that the next snapshot only holds the new increments.
+
+        Returns:
+            dict: Values keyed by Prometheus series name, e.g. 'visualtango_stage_seconds_total{stage="decode"}'.
+        """
+        with self._lock:
+            values = self._values
+            if reset:
+                self._values = {}
+            else:
+                values = dict(values)
+        return {series_name(name,labels):value for (name,labels),value in values.items()}
+
+def series_name(name,labels=()):
+    """
+    Args:
+        name (str): Name of the counter, without the namespace.
+        labels (tuple): (label, value) pairs.
+
+    Returns:
+        str: Prometheus series name.
+    """
+    if not labels:
+        return f"{NAMESPACE}_{name}"
+    text = ",".join(f'{label}="{str(value)}"' for label,value in labels)
+    return f"{NAMESPACE}_{name}{{{text}}}"
+
+# Counters of this process.
+metrics = Metrics()
+
+
+############################################################################################################################################
+################################################################ EXPORT  ###################################################################
+############################################################################################################################################
+
+def flush_to_redis(connection,key="metrics"):
+    """
+    Add the counters of this process to the totals kept in Redis, in one round trip, and reset them.
+    Web and worker processes all flush into the same hash, read back by render_prometheus().
+
+    Args:
+        connection (redis.StrictRedis): Redis connection.
+        key (str): Redis hash holding the totals.
+    """
+    values = metrics.snapshot(reset=True)
+    if not values:
+        return
+    pipe = connection.pipeline(transaction=False)
+    for series,value in values.items():
+        pipe.hincrbyfloat(key,series,value)
+    pipe.execute()
+
+def read_from_redis(connection,key="metrics"):
+    """
+    Args:
+        connection (redis.StrictRedis): Redis connection.
+        key (str): Redis hash holding the totals.
+
+    Returns:
+        dict: Totals keyed by series name.
+    """
+    return {series.decode():float(value) for series,value in connection.hgetall(key).items()}
+
+def render_prometheus(values):
+    """
+    Format counters in the Prometheus text exposition format.
+
+    Args:
+        values (dict): Values keyed by series name, see Metrics.snapshot().
+
+    Returns:
+        str: Exposition text.
+    """
+    lines = []
+    declared = set()
+    for series in sorted(values):
+        name = series.split("{")[0]
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{series} {values[series]!r}")
+    return "\n".join(lines) + "\n"
+
+def write_json_line(path,record):
+    """
+    Append a record to a JSON lines file.
+
+    Args:
+        path (str): Path of the file.
+        record (dict): Record to write.
+    """
+    line = json.dumps(record,sort_keys=True) + "\n"
+    with open(path,"a") as file:
+        file.write(line)
@@ -1,19 +1,32 @@
+import numpy as np
+
+# Order of the fields in the save file, one digit each: direction, height, name, rotation, slider, weighted leg, leaning.
+CODE_DIGITS = 7
+CODE_POWERS = 10 ** np.arange(CODE_DIGITS-1,-1,-1,dtype=np.int64)
+DIRECTION,HEIGHT,NAME,ROTATION,SLIDER,LEG,LEAN = range(CODE_DIGITS)
+
 class Pose:
     """
     Represents a pose with various attributes that describe its characteristics.
+    A pose is immutable and only stores the index of each attribute in the vocabularies shared by the class,
+    so it can be used as a dictionary key and is pickled as its integer code.
 
     Attributes:
-        _name (list): List of pose names.
-        _height (list): List of height variations.
-        _leg (list): List of leg positions.
-        _direction (list): List of directions.
-        _angle (list): List of angle variations.
-        _slider (list): List of slider values.
-        _lean (list): List of leaning positions.
+        _name (tuple): Pose names.
+        _height (tuple): Height variations.
+        _leg (tuple): Leg positions.
+        _direction (tuple): Directions.
+        _angle (tuple): Angle variations.
+        _slider (tuple): Slider values.
+        _lean (tuple): Leaning positions.
 
     Methods:
         __init__(name, height, leg, direction, slider, angle, lean):
             Initializes a Pose object with specified attributes.
+        from_code(code):
+            Returns the pose of an integer code.
+        replace(**attributes):
+            Returns a copy of the pose with some attributes changed.
         get_name():
             Returns the name of the pose.
         get_height():
@@ -42,7 +55,22 @@ class Pose:
             Returns the index of the slider attribute.
         get_lean_ind():
             Returns the index of the lean attribute.
+        code():
+            Returns the integer whose 7 digits are the save file encoding of the pose.
     """
+    __slots__ = ('_p','_h','_w','_d','_r','_t','_l')
+
+    _name = ( "Collected", "Corssed forward", "Forward", "Backward", "In air forward", "In air backward", "Slide outside", "Wrapped around", "Collected high", "Crossed backward" )
+    _height = ("straight", "bent", "tiptoe")
+    _leg = ("right", "left")
+    _direction = ("north", "northwest", "northeast")
+    _angle = (0, 30, 60, 90, 120, 150, 180, 270, 360)
+    _slider = (0,1,2,3,4,5,6,7)
+    _lean = ("straight","forward","backward")
+
+    # Poses already built from a code, shared since they are immutable.
+    _by_code = {}
+
     def __init__(self,name,height,leg,direction,slider,angle,lean):
         """
         Initializes a Pose object with specified attributes.
@@ -56,73 +84,172 @@ class Pose:
             angle (int): Angle variation of the pose.
             lean (str): Leaning position of the pose.
         """
-        self._name = [ "Collected", "Corssed forward", "Forward", "Backward", "In air forward", "In air backward", "Slide outside", "Wrapped around", "Collected high", "Crossed backward" ]
-        self._height = ["straight", "bent", "tiptoe"]
-        self._leg = ["right", "left"]
-        self._direction = ["north", "northwest", "northeast"]
-        self._angle = [0, 30, 60, 90, 120, 150, 180, 270, 360]
-        self._slider = [0,1,2,3,4,5,6,7]
-        self._lean = ["straight","forward","backward"]
-        self._p = self._name.index(name)
-        self._h = self._height.index(height)
-        self._w = self._leg.index(leg)
-        self._d = self._direction.index(direction)
-        self._r = self._angle.index(angle)
-        self._t = self._slider.index(slider)
-        self._l = self._lean.index(lean)
+        self._set(self._name.index(name),self._height.index(height),self._leg.index(leg),self._direction.index(direction),
+                  self._angle.index(angle),self._slider.index(slider),self._lean.index(lean))
+
+    def _set(self,p,h,w,d,r,t,l):
+        for slot,value in zip(self.__slots__,(p,h,w,d,r,t,l)):
+            object.__setattr__(self,slot,value)
+
+    def __setattr__(self,name,value):
+        raise AttributeError("Pose is immutable, use replace()")
+
+    __delattr__ = __setattr__
+
+    @classmethod
+    def from_code(cls,code):
+        """
+        Args:
+            code (int): Integer code of the pose, see code.
+
+        Returns:
+            Pose: The pose of the code, shared with the other users of the same code.
+        """
+        code = int(code)
+        pose = cls._by_code.get(code)
+        if pose is None:
+            d,h,p,r,t,w,l = (code // CODE_POWERS % 10).tolist()
+            if p >= len(cls._name) or h >= len(cls._height) or w >= len(cls._leg) or d >= len(cls._direction) \
+                    or r >= len(cls._angle) or t >= len(cls._slider) or l >= len(cls._lean) or code >= 10**CODE_DIGITS:
+                raise ValueError(f"Invalid pose code {code:07d}")
+            pose = object.__new__(cls)
+            pose._set(p,h,w,d,r,t,l)
+            cls._by_code[code] = pose
+        return pose
+
+    def replace(self,name=None,height=None,leg=None,direction=None,slider=None,angle=None,lean=None):
+        """
+        Returns:
+            Pose: Copy of the pose with the given attributes changed.
+        """
+        return Pose(self.get_name if name is None else name,self.get_height if height is None else height,
+                    self.get_leg if leg is None else leg,self.get_direction if direction is None else direction,
+                    self.get_slider if slider is None else slider,self.get_angle if angle is None else angle,
+                    self.get_lean if lean is None else lean)
+
+    def __reduce__(self):
+        return (Pose.from_code,(self.code,))
+
+    def __eq__(self,other):
+        return isinstance(other,Pose) and self.code == other.code
+
+    def __hash__(self):
+        return self.code
+
+    def __repr__(self):
+        return (f'Pose("{self.get_name}","{self.get_height}","{self.get_leg}","{self.get_direction}",'
+                f'{self.get_slider},{self.get_angle},"{self.get_lean}")')
 
     @property
     def get_name(self):
         return self._name[self._p]
-    
+
     @property
     def get_height(self):
         return self._height[self._h]
-    
+
     @property
     def get_leg(self):
         return self._leg[self._w]
-    
+
     @property
     def get_direction(self):
         return self._direction[self._d]
-    
+
     @property
     def get_angle(self):
         return self._angle[self._r]
-    
+
     @property
     def get_slider(self):
         return self._slider[self._t]
-    
+
     @property
-    def get_slider(self):
+    def get_lean(self):
         return self._lean[self._l]
-    
+
     @property
     def get_name_ind(self):
         return self._p
-    
+
     @property
     def get_height_ind(self):
         return self._h
-        
+
     @property
     def get_leg_ind(self):
         return self._w
-    
+
     @property
     def get_direction_ind(self):
         return self._d
-    
+
     @property
     def get_angle_ind(self):
         return self._r
-    
+
     @property
     def get_slider_ind(self):
         return self._t
-    
+
     @property
     def get_lean_ind(self):
-        return self._l
\ No newline at end of file
+        return self._l
+
+    @property
+    def code(self):
+        return (((((self._d*10 + self._h)*10 + self._p)*10 + self._r)*10 + self._t)*10 + self._w)*10 + self._l
+
+
+############################################################################################################################################
+################################################################ CODE ARRAYS  ##############################################################
+############################################################################################################################################
+
+def pack_codes(fields):
+    """
+    Args:
+        fields (numpy.array): Attribute indices of shape (N, 7), in the save file order (DIRECTION, HEIGHT, ... LEAN).
+
+    Returns:
+        numpy.array: Integer codes of shape (N,).
+    """
+    return np.asarray(fields,dtype=np.int64) @ CODE_POWERS
+
+def unpack_codes(codes):
+    """
+    Args:
+        codes (numpy.array): Integer codes of shape (N,).
+
+    Returns:
+        numpy.array: Attribute indices of shape (N, 7), in the save file order.
+    """
+    return np.asarray(codes,dtype=np.int64)[:,None] // CODE_POWERS % 10
+
+def codes_to_string(codes):
+    """
+    Write pose codes in the save file format: 7 digits per pose, without separator.
+
+    Args:
+        codes (numpy.array): Integer codes of shape (N,).
+
+    Returns:
+        str: Serialized poses.
+    """
+    digits = (unpack_codes(codes) + ord("0")).astype(np.uint8)
+    return digits.tobytes().decode("ascii")
+
+def string_to_codes(text):
+    """
+    Read pose codes from the save file format.
+
+    Args:
+        text (str): Serialized poses, 7 digits per pose.
+
+    Returns:
+        numpy.array: Integer codes of shape (N,).
+    """
+    text = text.strip()
+    if len(text) % CODE_DIGITS != 0 or not text.isdigit() and text:
+        raise ValueError("A save file holds 7 digits per pose")
+    digits = np.frombuffer(text.encode("ascii"),dtype=np.uint8).reshape(-1,CODE_DIGITS) - ord("0")
+    return pack_codes(digits)
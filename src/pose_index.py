@@ -0,0 +1,225 @@
+import numpy as np
+import hashlib
+import json
+import os
+import sys
+from src.pose_library import load_library
+
+############################################################################################################################################
+################################################################ IVF INDEX  ################################################################
+############################################################################################################################################
+
+# An inverted file index groups the references around centroids found by k-means. A search only scans the references of
+# the nprobe lists whose centroids are the closest to the frame: more lists probed means better recall and slower search.
+# It is stored next to the pose library, as files sharing the prefix <library prefix>.ivf:
+#   <prefix>.ivf.json          : {"version", "lists", "references", "dimensions", "checksum"}, checksum of the indexed library
+#   <prefix>.ivf.centroids.npy : float64 (L, D) centroids
+#   <prefix>.ivf.ids.npy       : int64 (K,) reference indices grouped by list
+#   <prefix>.ivf.offsets.npy   : int64 (L+1,) start of each list in ids
+#   <prefix>.ivf.vectors.npy   : float64 (K, D) references in the order of ids, so that each list is contiguous
+INDEX_VERSION = 1
+
+# Below this number of references, the exact search is fast enough and always used.
+EXACT_SEARCH_MAX_REFERENCES = 2048
+
+# Default number of lists probed per frame.
+DEFAULT_NPROBE = 8
+
+# Maximum number of (frame, vector) distances computed at once.
+SEARCH_BLOCK_SIZE = 1 << 20
+
+def library_checksum(matrix):
+    """
+    Args:
+        matrix (numpy.array): References of shape (K, ...).
+
+    Returns:
+        str: SHA-256 of the references as float64, to tell whether an index was built from this library.
+    """
+    return hashlib.sha256(np.ascontiguousarray(matrix,dtype=np.float64).tobytes()).hexdigest()
+
+def _squared_distances(frames,vectors):
+    """
+    Args:
+        frames (numpy.array): Array of shape (F, D).
+        vectors (numpy.array): Array of shape (N, D).
+
+    Returns:
+        numpy.array: Squared Euclidean distances of shape (F, N).
+    """
+    dist = (frames*frames).sum(axis=1)[:,None] - 2*frames@vectors.T + (vectors*vectors).sum(axis=1)[None,:]
+    return np.maximum(dist,0,out=dist)
+
+def _assign(vectors,centroids):
+    labels = np.zeros(len(vectors),dtype=np.int64)
+    block = max(1,SEARCH_BLOCK_SIZE // max(1,len(centroids)))
+    for start in range(0,len(vectors),block):
+        labels[start:start+block] = np.argmin(_squared_distances(vectors[start:start+block],centroids),axis=1)
+    return labels
+
+def kmeans(vectors,lists,iterations=20,seed=0):
+    """
+    Lloyd's k-means, initialised on random references. Empty lists are reseeded on the farthest references.
+
+    Args:
+        vectors (numpy.array): Array of shape (K, D).
+        lists (int): Number of centroids.
+        iterations (int): Number of iterations.
+        seed (int): Seed of the initialisation, so that the index is reproducible.
+
+    Returns:
+        tuple: Centroids of shape (lists, D) and list of each vector, shape (K,).
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors),lists,replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(vectors,centroids)
+        counts = np.bincount(labels,minlength=lists)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums,labels,vectors)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty,None]
+        if empty.any():
+            farthest = np.argsort(((vectors-centroids[labels])**2).sum(axis=1))[::-1][:empty.sum()]
+            centroids[empty] = vectors[farthest]
+    return centroids,_assign(vectors,centroids)
+
+def build_index(prefix,matrix,lists=None,iterations=20,seed=0):
+    """
+    Build the IVF index of a reference matrix and write it next to the library. Run offline, see the CLI below.
+
+    Args:
+        prefix (str): Path of the pose library without extension.
+        matrix (numpy.array): References of shape (K, ...), flattened to (K, D).
+        lists (int): Number of lists, defaults to about the square root of K.
+        iterations (int): Number of k-means iterations.
+        seed (int): Seed of the k-means initialisation.
+
+    Returns:
+        str: Prefix of the written index.
+    """
+    vectors = np.ascontiguousarray(np.asarray(matrix,dtype=np.float64).reshape(len(matrix),-1))
+    if lists is None:
+        lists = max(1,int(round(np.sqrt(len(vectors)))))
+    lists = min(lists,len(vectors))
+    centroids,labels = kmeans(vectors,lists,iterations,seed)
+    ids = np.argsort(labels,kind="stable")
+    offsets = np.concatenate(([0],np.cumsum(np.bincount(labels,minlength=lists))))
+    index_prefix = f"{prefix}.ivf"
+    np.save(f"{index_prefix}.centroids.npy",centroids)
+    np.save(f"{index_prefix}.ids.npy",ids)
+    np.save(f"{index_prefix}.offsets.npy",offsets)
+    np.save(f"{index_prefix}.vectors.npy",vectors[ids])
+    with open(f"{index_prefix}.json","w") as file:
+        json.dump({"version":INDEX_VERSION,"lists":lists,"references":len(vectors),"dimensions":vectors.shape[1],
+                   "checksum":library_checksum(vectors)},file,indent=1)
+    return index_prefix
+
+def index_exists(prefix):
+    """
+    Args:
+        prefix (str): Path of the pose library without extension.
+
+    Returns:
+        bool: True if an IVF index was built for the library.
+    """
+    return os.path.exists(f"{prefix}.ivf.json")
+
+class IVFIndex:
+    """
+    Inverted file index over the reference vectors, memory-mapped so that the worker processes share its pages.
+
+    Attributes:
+        header (dict): Content of <prefix>.ivf.json.
+        centroids (numpy.array): Centroids of shape (L, D).
+        ids (numpy.array): Reference indices grouped by list.
+        offsets (numpy.array): Start of each list in ids, shape (L+1,).
+        vectors (numpy.array): References in the order of ids.
+        nprobe (int): Number of lists probed per frame.
+    """
+    def __init__(self,prefix,nprobe=DEFAULT_NPROBE):
+        index_prefix = f"{prefix}.ivf"
+        with open(f"{index_prefix}.json","r") as file:
+            header = json.load(file)
+        if header.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported pose index version {header.get('version')} in {index_prefix}.json")
+        self.header = header
+        self.centroids = np.load(f"{index_prefix}.centroids.npy")
+        self.ids = np.load(f"{index_prefix}.ids.npy",mmap_mode="r")
+        self.offsets = np.load(f"{index_prefix}.offsets.npy")
+        self.vectors = np.load(f"{index_prefix}.vectors.npy",mmap_mode="r")
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return len(self.ids)
+
+    def matches(self,matrix):
+        """
+        Args:
+            matrix (numpy.array): References of the loaded library, shape (K, ...).
+
+        Returns:
+            bool: True if the index was built from these references. Indexes without checksum only compare the counts.
+        """
+        if self.header.get("references") != len(matrix) or len(self.ids) != len(matrix):
+            return False
+        checksum = self.header.get("checksum")
+        return checksum is None or checksum == library_checksum(np.asarray(matrix).reshape(len(matrix),-1))
+
+    def search(self,frames,k=1,nprobe=None):
+        """
+        Find the approximate k nearest references of every frame.
+        Frames are grouped by probed list, so each list is scanned once for all the frames that probe it.
+
+        Args:
+            frames (numpy.array): Frame vectors of shape (F, D).
+            k (int): Number of neighbours to return.
+            nprobe (int): Number of lists probed per frame, defaults to the nprobe of the index.
+
+        Returns:
+            tuple: Reference indices and distances of the neighbours, both of shape (F, k), closest first.
+                Frames whose probed lists hold fewer than k references are searched again in every list.
+        """
+        frames = np.asarray(frames,dtype=np.float64)
+        nprobe = min(nprobe or self.nprobe,len(self.centroids))
+        ids,dist = self._probe(frames,k,nprobe)
+        short = (ids < 0).any(axis=1)
+        if short.any() and nprobe < len(self.centroids):
+            ids[short],dist[short] = self._probe(frames[short],k,len(self.centroids))
+        return ids,dist
+
+    def _probe(self,frames,k,nprobe):
+        # indices are -1 and distances infinite when the probed lists hold fewer than k references
+        k = min(k,len(self.ids))
+        best_dist = np.full((len(frames),k),np.inf)
+        best_ids = np.full((len(frames),k),-1,dtype=np.int64)
+        if len(frames) == 0 or k == 0:
+            return best_ids,np.sqrt(best_dist)
+        coarse = _squared_distances(frames,self.centroids)
+        probes = np.argpartition(coarse,nprobe-1,axis=1)[:,:nprobe] if nprobe < len(self.centroids) else \
+            np.broadcast_to(np.arange(len(self.centroids)),(len(frames),nprobe))
+        pairs = np.argsort(probes.ravel(),kind="stable")
+        lists = probes.ravel()[pairs]
+        bounds = np.searchsorted(lists,np.arange(len(self.centroids)+1))
+        for l in range(len(self.centroids)):
+            members = pairs[bounds[l]:bounds[l+1]] // nprobe
+            start,stop = self.offsets[l],self.offsets[l+1]
+            if len(members) == 0 or start == stop:
+                continue
+            dist = _squared_distances(frames[members],np.asarray(self.vectors[start:stop]))
+            candidates_dist = np.concatenate((best_dist[members],dist),axis=1)
+            candidates_ids = np.concatenate((best_ids[members],np.broadcast_to(np.asarray(self.ids[start:stop]),dist.shape)),axis=1)
+            keep = np.argpartition(candidates_dist,k-1,axis=1)[:,:k] if candidates_dist.shape[1] > k else \
+                np.broadcast_to(np.arange(k),(len(members),k))
+            best_dist[members] = np.take_along_axis(candidates_dist,keep,axis=1)
+            best_ids[members] = np.take_along_axis(candidates_ids,keep,axis=1)
+        order = np.argsort(best_dist,axis=1,kind="stable")
+        return np.take_along_axis(best_ids,order,axis=1),np.sqrt(np.take_along_axis(best_dist,order,axis=1))
+
+if __name__=='__main__':
+
+    # python -m src.pose_index src/output/angle_for_classification [lists]
+    prefix = sys.argv[1]
+    index,matrix = load_library(prefix)
+    lists = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    print(f"{len(matrix)} references -> {build_index(prefix,matrix,lists)}.*")
@@ -0,0 +1,132 @@
+import numpy as np
+import ast
+import json
+import os
+import sys
+from src.tomatrix import pose_to_matrix
+
+############################################################################################################################################
+################################################################ BINARY FORMAT  ############################################################
+############################################################################################################################################
+
+# A pose library is stored as two files sharing the same prefix:
+#   <prefix>.npy  : float64 array of shape (K, ...) holding one matrix per reference pose
+#   <prefix>.json : index {"version", "kind", "shape", "dtype", "descriptors"} with one descriptor per row
+FORMAT_VERSION = 1
+
+def save_library(prefix,descriptors,matrix,kind):
+    """
+    Write a pose library in the binary format.
+
+    Args:
+        prefix (str): Path of the library without extension.
+        descriptors (list): Descriptor string of each pose, e.g. 'Pose("Collected","straight","right","north",3,0,"straight")'.
+        matrix (numpy.array): Array of shape (K, ...) with one row per descriptor.
+        kind (str): Kind of data stored ("angle" or "position").
+    """
+    matrix = np.ascontiguousarray(matrix,dtype=np.float64)
+    if len(descriptors) != len(matrix):
+        raise ValueError(f"{len(descriptors)} descriptors for {len(matrix)} poses")
+    np.save(f"{prefix}.npy",matrix)
+    index = {"version":FORMAT_VERSION,"kind":kind,"shape":list(matrix.shape),
+             "dtype":matrix.dtype.str,"descriptors":list(descriptors)}
+    with open(f"{prefix}.json","w") as file:
+        json.dump(index,file,indent=1)
+
+def load_library(prefix):
+    """
+    Load a pose library, memory-mapping the matrix instead of reading it.
+
+    Args:
+        prefix (str): Path of the library without extension.
+
+    Returns:
+        tuple: Index (dict) and read-only memory-mapped matrix (numpy.memmap).
+    """
+    with open(f"{prefix}.json","r") as file:
+        index = json.load(file)
+    if index.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported pose library version {index.get('version')} in {prefix}.json")
+    matrix = np.load(f"{prefix}.npy",mmap_mode="r")
+    if list(matrix.shape) != index["shape"] or matrix.dtype.str != index["dtype"]:
+        raise ValueError(f"{prefix}.npy does not match its index")
+    return index,matrix
+
+def library_exists(prefix):
+    """
+    Check whether a binary pose library exists.
+
+    Args:
+        prefix (str): Path of the library without extension.
+
+    Returns:
+        bool: True if both files exist.
+    """
+    return os.path.exists(f"{prefix}.json") and os.path.exists(f"{prefix}.npy")
+
+
+############################################################################################################################################
+################################################################ TEXT CONVERSION  ##########################################################
+############################################################################################################################################
+
+def _literal(node):
+    """
+    Evaluate a literal expression node, also accepting numpy array(...) reprs.
+
+    Args:
+        node (ast.AST): Expression node.
+
+    Returns:
+        object: The evaluated value.
+    """
+    if isinstance(node,ast.Call) and isinstance(node.func,ast.Name) and node.func.id == "array":
+        return np.array(_literal(node.args[0]),dtype=np.float64)
+    if isinstance(node,ast.Dict):
+        return {_literal(k):_literal(v) for k,v in zip(node.keys,node.values)}
+    if isinstance(node,(ast.List,ast.Tuple)):
+        return [_literal(item) for item in node.elts]
+    return ast.literal_eval(node)
+
+def read_text_library(path):
+    """
+    Read a pose library printed as a Python literal (angle_for_classification.txt, position_for_classification.txt).
+
+    Args:
+        path (str): Path to the text file.
+
+    Returns:
+        dict: Dictionary mapping descriptors to their pose data.
+    """
+    with open(path,"r") as file:
+        return _literal(ast.parse(file.read(),mode="eval").body)
+
+def convert_text_library(path,prefix=None):
+    """
+    Convert a text pose library to the binary format.
+
+    Args:
+        path (str): Path to the text file.
+        prefix (str): Path of the binary library without extension. Defaults to the text path without extension.
+
+    Returns:
+        str: Prefix of the written library.
+    """
+    if prefix is None:
+        prefix = os.path.splitext(path)[0]
+    data = read_text_library(path)
+    descriptors = list(data.keys())
+    if all(isinstance(value,dict) for value in data.values()):
+        kind = "angle"
+        matrix = np.array([pose_to_matrix(data[d]) for d in descriptors])
+    else:
+        kind = "position"
+        matrix = np.array([data[d] for d in descriptors])
+    save_library(prefix,descriptors,matrix,kind)
+    return prefix
+
+if __name__=='__main__':
+
+    # python -m src.pose_library src/output/angle_for_classification.txt src/output/position_for_classification.txt
+    for path in sys.argv[1:]:
+        prefix = convert_text_library(path)
+        print(f"{path} -> {prefix}.npy, {prefix}.json")
@@ -1,10 +1,6 @@
-import cv2
-import mediapipe as mp
 import numpy as np
 import math
-
-mp_drawing = mp.solutions.drawing_utils
-mp_pose = mp.solutions.pose
+from src.video_analysis import extract_landmarks
 
 ############################################################################################################################################
 ###################################################### COORDINATE SYSTEM COMPUTATION  ######################################################
@@ -58,80 +54,26 @@ def coordinate_system_initialisation(lmList,articulation):
 ################################################################ VIDEO PROCESSING  #########################################################
 ############################################################################################################################################
 
-def process_image(image_path, all_poses, nompose):
+def process_image(image_path, all_poses, nompose, preview=None):
     """
     Process a video to extract pose landmarks and angles.
+    Runs headless; an annotated preview video is written only when a preview path is given.
 
     Args:
         image_path (str): Path to the video file.
         all_poses (dict): Dictionary to store pose angles for different poses.
         nompose (str): Name of the pose.
+        preview (str): Debug mode: path of an annotated preview video.
 
     Returns:
         dict: Updated dictionary containing pose angles.
     """
-    process = True
-    #Processing of the video 
-    with mp_pose.Pose(min_detection_confidence=0.5,min_tracking_confidence=0.5) as pose:
-        #import the video to process
-        video = cv2.VideoCapture(image_path)
-        width,height = video.get(cv2.CAP_PROP_FRAME_WIDTH),video.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        n = 33
-        frame = 0
-        while process:
-            success,img = video.read()
-            if success:
-
-                #recolor the image
-                img = cv2.cvtColor(img,cv2.COLOR_BGR2RGB)
-                img.flags.writeable = False
-
-                #detect the pose
-                results = pose.process(img)
-
-                #recolor the image
-                img.flags.writeable = True
-                img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-
-                lmList = np.zeros((n,3))
-
-                #landmark extraction
-                try :
-                    landmarks = results.pose_landmarks.landmark
-                    for i in range(len(landmarks)):
-                        lmList[i,0] = landmarks[i].x*10
-                        lmList[i,1] = landmarks[i].y*10
-                        lmList[i,2] = landmarks[i].z*10
-                except : 
-                    pass
-
-                # render detection
-                mp_drawing.draw_landmarks(img,results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
-                                        mp_drawing.DrawingSpec(color=(245,117,66),thickness=2,circle_radius=2),
-                                        mp_drawing.DrawingSpec(color=(245,66,230),thickness=2,circle_radius=2))
-
-
-                new_lmList,coordinate_system = list(coordinate_system_initialisation(lmList,12))
-
-                
-                print(lmList)
-                print("")
-                print(new_lmList)
-
-                #adding each angle of articulation to a dictionnary
-                #print(new_lmList)
-                img = cv2.resize(img, (960, 540)) 
-
-
-                cv2.imshow('image',img)
-            
-                frame += 1 
-                cv2.waitKey(1)  
-            else : 
-                process = False
+    landmarks,detected = extract_landmarks(image_path,preview=preview)
+    if len(landmarks) == 0:
+        raise ValueError(f"No frame could be read from {image_path}")
 
-    #free the windows
-    cv2.destroyAllWindows()
-    video.release()
+    #the landmarks of the last frame are kept
+    lmList = landmarks[-1,:,:3].astype(np.float64)*10
+    new_lmList,coordinate_system = list(coordinate_system_initialisation(lmList,12))
     all_poses[nompose] = new_lmList
-    return all_poses
\ No newline at end of file
+    return all_poses
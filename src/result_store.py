@@ -0,0 +1,168 @@
+import gzip
+import os
+import time
+
+############################################################################################################################################
+################################################################ BLOB STORE  ###############################################################
+############################################################################################################################################
+
+class LocalBlobStore:
+    """
+    Keeps large payloads in a local folder, as a stand-in for an object store shared by the web and worker processes.
+    The modification time of a blob is its creation, blobs older than the TTL are removed on the next write.
+
+    Attributes:
+        folder (str): Folder holding the blobs.
+        ttl (int): Time in seconds after which a blob expires.
+    """
+    def __init__(self,folder,ttl):
+        self.folder = folder
+        self.ttl = ttl
+
+    def _path(self,name):
+        return os.path.join(self.folder,name)
+
+    def put(self,name,data):
+        os.makedirs(self.folder,exist_ok=True)
+        path = self._path(name)
+        # write then rename so that a concurrent reader never sees a partial blob
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path,'wb') as file:
+            file.write(data)
+        os.replace(temp_path,path)
+        self.evict()
+
+    def get(self,name):
+        try:
+            with open(self._path(name),'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self,name):
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """
+        Remove the expired blobs.
+        """
+        now = time.time()
+        for filename in os.listdir(self.folder):
+            path = os.path.join(self.folder,filename)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+############################################################################################################################################
+################################################################ RESULT STORE  #############################################################
+############################################################################################################################################
+
+# Each stored value starts with a tag giving its encoding.
+RAW = b'R'
+GZIP = b'G'
+BLOB = b'B'
+
+class ResultStore:
+    """
+    Stores the results of a job as one Redis hash, job_<id>, that expires with the job.
+    Large values are gzip-compressed, and values still larger than spill_bytes are moved to the blob store with only
+    their name kept in the hash. Writes and reads are a single round trip to Redis.
+
+    Attributes:
+        connection (redis.StrictRedis): Redis connection.
+        ttl (int): Time in seconds after which the results of a job expire.
+        compress_bytes (int): Values of at least this size are compressed.
+        spill_bytes (int): Compressed values of at least this size go to the blob store, 0 to keep everything in Redis.
+        blobs (LocalBlobStore): Blob store of the spilled values.
+    """
+    def __init__(self,connection,ttl,compress_bytes=1024,spill_bytes=0,blobs=None):
+        self.connection = connection
+        self.ttl = ttl
+        self.compress_bytes = compress_bytes
+        self.spill_bytes = spill_bytes
+        self.blobs = blobs
+
+    def _key(self,id):
+        return f"job_{id}"
+
+    def save(self,id,**fields):
+        """
+        Store results of a job, replacing its previous results, and reset its expiry.
+
+        Args:
+            id (str): The unique identifier of the job.
+            **fields: Values to store (bytes or str).
+        """
+        mapping = {}
+        for field,value in fields.items():
+            if isinstance(value,str):
+                value = value.encode('utf-8')
+            if len(value) >= self.compress_bytes:
+                value = GZIP + gzip.compress(value,compresslevel=6)
+            else:
+                value = RAW + value
+            if self.spill_bytes and self.blobs is not None and len(value) >= self.spill_bytes:
+                name = f"{id}_{field}"
+                self.blobs.put(name,value)
+                value = BLOB + name.encode('utf-8')
+            mapping[field] = value
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.delete(self._key(id))
+        pipe.hset(self._key(id),mapping=mapping)
+        pipe.expire(self._key(id),self.ttl)
+        pipe.execute()
+
+    def _resolve(self,value):
+        if value is not None and value[:1] == BLOB:
+            value = self.blobs.get(value[1:].decode('utf-8')) if self.blobs is not None else None
+        return value
+
+    def load_encoded(self,id,*fields):
+        """
+        Read results of a job without decompressing them, in one round trip.
+
+        Args:
+            id (str): The unique identifier of the job.
+            *fields: Names of the values.
+
+        Returns:
+            list: (compressed, data) for each field, compressed being True for gzip data, or None when missing.
+        """
+        values = self.connection.hmget(self._key(id),fields) if fields else []
+        encoded = []
+        for value in values:
+            value = self._resolve(value)
+            encoded.append(None if value is None else (value[:1] == GZIP,value[1:]))
+        return encoded
+
+    def load(self,id,*fields):
+        """
+        Read results of a job in one round trip.
+
+        Args:
+            id (str): The unique identifier of the job.
+            *fields: Names of the values.
+
+        Returns:
+            list: Each value as bytes, or None when missing.
+        """
+        return [None if value is None else gzip.decompress(value[1]) if value[0] else value[1]
+                for value in self.load_encoded(id,*fields)]
+
+    def delete(self,id):
+        """
+        Remove the results of a job and their spilled blobs.
+
+        Args:
+            id (str): The unique identifier of the job.
+        """
+        for value in self.connection.hvals(self._key(id)):
+            if value[:1] == BLOB and self.blobs is not None:
+                self.blobs.delete(value[1:].decode('utf-8'))
+        self.connection.delete(self._key(id))
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+############################################################################################################################################
+################################################################ UPLOAD STORAGE  ###########################################################
+############################################################################################################################################
+
+# Size of the blocks copied from the request stream to the storage.
+COPY_BLOCK_SIZE = 1 << 20
+
+class LocalStorage:
+    """
+    Stores uploaded videos in a local folder. Used for development, tests and single-node deployments,
+    and as a stand-in for an object store.
+    A chunked upload is written to <name>.part and renamed to <name> once complete.
+    Names may contain a sub-folder, e.g. <job id>/<file>, created on the first write.
+
+    Attributes:
+        folder (str): Folder holding the videos.
+    """
+    def __init__(self,folder):
+        self.folder = folder
+
+    def _path(self,name):
+        return os.path.join(self.folder,name)
+
+    def size(self,name):
+        """
+        Args:
+            name (str): Name of the video.
+
+        Returns:
+            int: Number of bytes already received by an unfinished upload, used to resume it.
+        """
+        part = f"{self._path(name)}.part"
+        return os.path.getsize(part) if os.path.exists(part) else 0
+
+    def write_chunk(self,name,offset,total,stream):
+        """
+        Append a chunk of an upload, streamed from the request.
+
+        Args:
+            name (str): Name of the video.
+            offset (int): Position of the chunk in the video, must be the number of bytes already received.
+            total (int): Size of the whole video.
+            stream: File-like object to read the chunk from.
+
+        Returns:
+            int: Number of bytes received so far.
+        """
+        os.makedirs(os.path.dirname(self._path(name)),exist_ok=True)
+        part = f"{self._path(name)}.part"
+        with open(part,'r+b' if offset > 0 else 'wb') as file:
+            file.seek(offset)
+            shutil.copyfileobj(stream,file,COPY_BLOCK_SIZE)
+            file.truncate()
+            received = file.tell()
+        if received >= total:
+            os.replace(part,self._path(name))
+        return received
+
+    def save(self,name,stream):
+        """
+        Store a whole video streamed from the request.
+
+        Args:
+            name (str): Name of the video.
+            stream: File-like object to read the video from.
+        """
+        os.makedirs(os.path.dirname(self._path(name)),exist_ok=True)
+        with open(self._path(name),'wb') as file:
+            shutil.copyfileobj(stream,file,COPY_BLOCK_SIZE)
+
+    def source(self,name):
+        """
+        Args:
+            name (str): Name of the video.
+
+        Returns:
+            str: Path or URL that cv2.VideoCapture can read the video from.
+        """
+        return self._path(name)
+
+    @contextmanager
+    def local_copy(self,name):
+        """
+        Args:
+            name (str): Name of the video.
+
+        Yields:
+            str: Path of the video on the local disk, the stored file itself.
+        """
+        yield self._path(name)
+
+    def delete(self,name):
+        for path in (self._path(name),f"{self._path(name)}.part"):
+            if os.path.exists(path):
+                os.remove(path)
+
+class CloudinaryStorage:
+    """
+    Stores uploaded videos on Cloudinary. Chunks are forwarded to the Cloudinary chunked upload API as they arrive,
+    so nothing is written to the local disk. Cloudinary needs chunks of at least 5 MB, except the last one.
+    The number of bytes received for each upload is kept in Redis so that any web worker can resume it.
+
+    Attributes:
+        connection (redis.StrictRedis): Redis connection.
+        folder (str): Cloudinary folder of the videos.
+    """
+    def __init__(self,connection,folder="myfolder/mysubfolder"):
+        self.connection = connection
+        self.folder = folder
+
+    def _public_id(self,name):
+        return f"{self.folder}/id_{name}"
+
+    def size(self,name):
+        received = self.connection.get(f"upload_{name}")
+        return 0 if received is None else int(received)
+
+    def write_chunk(self,name,offset,total,stream):
+        import cloudinary.uploader
+        chunk = stream.read()
+        cloudinary.uploader.upload_large_part((name,chunk),resource_type="video",public_id=self._public_id(name),
+                                              http_headers={"Content-Range":f"bytes {offset}-{offset+len(chunk)-1}/{total}",
+                                                            "X-Unique-Upload-Id":hashlib.sha1(name.encode()).hexdigest()})
+        received = offset + len(chunk)
+        if received < total:
+            self.connection.set(f"upload_{name}",received,ex=24*3600)
+        else:
+            self.connection.delete(f"upload_{name}")
+        return received
+
+    def save(self,name,stream):
+        import cloudinary.uploader
+        cloudinary.uploader.upload_large(stream,resource_type="video",public_id=self._public_id(name))
+
+    def source(self,name):
+        import cloudinary
+        return cloudinary.CloudinaryVideo(self._public_id(name)).build_url(resource_type="video")
+
+    @contextmanager
+    def local_copy(self,name):
+        """
+        Download a video to a temporary file, so that it can be hashed for the landmark cache and decoded locally.
+
+        Args:
+            name (str): Name of the video.
+
+        Yields:
+            str: Path of the temporary file, removed on exit.
+        """
+        from urllib.request import urlopen
+        descriptor,path = tempfile.mkstemp(suffix=os.path.splitext(name)[1])
+        try:
+            with os.fdopen(descriptor,'wb') as file,urlopen(self.source(name)) as response:
+                shutil.copyfileobj(response,file,COPY_BLOCK_SIZE)
+            yield path
+        finally:
+            os.remove(path)
+
+    def delete(self,name):
+        import cloudinary.api
+        cloudinary.api.delete_resources([self._public_id(name)],resource_type="video")
+        self.connection.delete(f"upload_{name}")
@@ -0,0 +1,153 @@
+import os
+import re
+import shutil
+import time
+
+############################################################################################################################################
+################################################################ TEMP STORE  ###############################################################
+############################################################################################################################################
+
+# Job ids are generated by the app as timestamps, anything else could escape the root folder.
+JOB_ID = re.compile(r"^[A-Za-z0-9]+$")
+
+class TempStore:
+    """
+    Stores the temporary files of the jobs (uploads, save files, animations, previews) in one folder per job, <root>/<id>.
+    The modification time of a job folder is its last access, used for both the TTL and the LRU eviction.
+    A job holds a lease while it is processed or viewed, and is never evicted before the lease ends.
+    Leases are kept in Redis so that the web and worker processes share them, and the cleanup runs in one process at a time.
+
+    Attributes:
+        root (str): Folder holding the job folders.
+        connection (redis.StrictRedis): Redis connection.
+        max_bytes (int): Maximum total size of the job folders.
+        ttl (int): Time in seconds after which an unused job folder expires.
+        prefix (str): Prefix of the Redis keys.
+    """
+    def __init__(self,root,connection,max_bytes,ttl,prefix='temp'):
+        self.root = root
+        self.connection = connection
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def folder(self,id):
+        """
+        Args:
+            id (str): The unique identifier of the job.
+
+        Returns:
+            str: Folder of the job, created if needed.
+        """
+        if not JOB_ID.match(id):
+            raise ValueError(f"Invalid job id {id}")
+        folder = os.path.join(self.root,id)
+        os.makedirs(folder,exist_ok=True)
+        return folder
+
+    def path(self,id,name):
+        """
+        Args:
+            id (str): The unique identifier of the job.
+            name (str): Name of the file.
+
+        Returns:
+            str: Path of the file in the folder of the job.
+        """
+        return os.path.join(self.folder(id),name)
+
+    def write(self,id,name,text):
+        """
+        Write a text file of a job, replacing it atomically so that a concurrent reader never sees a partial file.
+
+        Args:
+            id (str): The unique identifier of the job.
+            name (str): Name of the file.
+            text (str): Content of the file.
+
+        Returns:
+            str: Path of the file.
+        """
+        path = self.path(id,name)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path,'w') as file:
+            file.write(text)
+        os.replace(temp_path,path)
+        return path
+
+    def find(self,id,name):
+        """
+        Find a file of a job and mark the job as used.
+
+        Args:
+            id (str): The unique identifier of the job.
+            name (str): Name of the file.
+
+        Returns:
+            str: Path of the file, or None if it does not exist.
+        """
+        if not JOB_ID.match(id):
+            return None
+        folder = os.path.join(self.root,id)
+        path = os.path.join(folder,name)
+        if not os.path.isfile(path):
+            return None
+        os.utime(folder)
+        return path
+
+    def lease(self,id,seconds):
+        """
+        Protect a job from the cleanup for the given time, replacing its previous lease.
+
+        Args:
+            id (str): The unique identifier of the job.
+            seconds (int): Duration of the lease.
+        """
+        self.connection.zadd(f"{self.prefix}_leases",{id:time.time()+seconds})
+
+    def _leased(self,now):
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.zremrangebyscore(f"{self.prefix}_leases",'-inf',now)
+        pipe.zrange(f"{self.prefix}_leases",0,-1)
+        return {id.decode('utf-8') for id in pipe.execute()[1]}
+
+    def clean(self,batch,lock_seconds=60):
+        """
+        Remove expired job folders, then the least recently used ones until the root fits in max_bytes.
+        Leased jobs are skipped and at most batch folders are removed, the rest is left to the next run.
+        Does nothing when another process cleaned less than lock_seconds ago.
+
+        Args:
+            batch (int): Maximum number of job folders removed.
+            lock_seconds (int): Time during which the other cleanups are skipped.
+
+        Returns:
+            int: Number of job folders removed, or None when another process holds the cleanup.
+        """
+        if not self.connection.set(f"{self.prefix}_clean_lock",os.getpid(),nx=True,ex=lock_seconds):
+            return None
+        if not os.path.isdir(self.root):
+            return 0
+        now = time.time()
+        leased = self._leased(now)
+        jobs = []
+        total = 0
+        for entry in os.scandir(self.root):
+            if not entry.is_dir():
+                continue
+            try:
+                size = sum(file.stat().st_size for file in os.scandir(entry.path) if file.is_file())
+                jobs.append((entry.stat().st_mtime,size,entry.name,entry.path))
+            except FileNotFoundError:
+                continue
+            total += size
+        removed = 0
+        for accessed,size,id,path in sorted(jobs):
+            if removed >= batch or (total <= self.max_bytes and now - accessed <= self.ttl):
+                break
+            if id in leased:
+                continue
+            shutil.rmtree(path,ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,161 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+############################################################################################################################################
+################################################################ SMOOTHING  ################################################################
+############################################################################################################################################
+
+# Savitzky-Golay filter of the landmarks: odd window in frames and polynomial order.
+DEFAULT_SMOOTHING_WINDOW = 9
+DEFAULT_SMOOTHING_ORDER = 2
+
+def fill_missing(landmarks,detected):
+    """
+    Give the frames without detection the landmarks of the closest previous detection (of the first one at the start).
+
+    Args:
+        landmarks (numpy.array): Landmarks of shape (F, 33, C).
+        detected (numpy.array): Detection mask of shape (F,).
+
+    Returns:
+        numpy.array: Filled copy of the landmarks, unchanged when nothing is detected.
+    """
+    detected = np.asarray(detected,dtype=bool)
+    if not detected.any():
+        return np.array(landmarks)
+    source = np.where(detected,np.arange(len(detected)),0)
+    np.maximum.accumulate(source,out=source)
+    source[:np.argmax(detected)] = np.argmax(detected)
+    return landmarks[source]
+
+def savgol_coefficients(window,order):
+    """
+    Args:
+        window (int): Odd window length.
+        order (int): Order of the fitted polynomial, lower than window.
+
+    Returns:
+        numpy.array: Weights of shape (window,) giving the smoothed value at the centre of the window.
+    """
+    half = window // 2
+    vander = np.vander(np.arange(-half,half+1,dtype=np.float64),order+1,increasing=True)
+    return np.linalg.pinv(vander)[0]
+
+def smooth_landmarks(landmarks,detected,window=DEFAULT_SMOOTHING_WINDOW,order=DEFAULT_SMOOTHING_ORDER):
+    """
+    Filter the jitter of the landmarks over time with a Savitzky-Golay filter, which keeps the peaks of the movements
+    better than a moving average. Frames without detection are filled first so that they do not pull the curve to zero.
+    The edges are padded with the first and last frames.
+
+    Args:
+        landmarks (numpy.array): Landmarks of shape (F, 33, C), as returned by video_analysis.extract_landmarks().
+        detected (numpy.array): Detection mask of shape (F,).
+        window (int): Window length in frames, made odd and shortened for short clips.
+        order (int): Order of the fitted polynomial.
+
+    Returns:
+        numpy.array: Smoothed landmarks in float32, same shape as the input.
+    """
+    filled = fill_missing(np.asarray(landmarks,dtype=np.float32),detected)
+    window = min(window | 1,(len(filled)-1) | 1)
+    if window <= order or len(filled) < 2:
+        return filled
+    half = window // 2
+    padded = np.concatenate((np.repeat(filled[:1],half,axis=0),filled,np.repeat(filled[-1:],half,axis=0)))
+    windows = sliding_window_view(padded,window,axis=0)
+    return (windows @ savgol_coefficients(window,order).astype(np.float32)).astype(np.float32)
+
+
+############################################################################################################################################
+################################################################ SEGMENTATION  #############################################################
+############################################################################################################################################
+
+# Shortest pose interval worth a switch: the default switch penalty is this many frames of typical distance.
+DEFAULT_MIN_SEGMENT_FRAMES = 8
+
+def viterbi_segments(distances,penalty):
+    """
+    Assign a reference to every frame, minimising the total distance plus a penalty for each change of reference.
+    Viterbi decoding with the same cost for every transition, so each frame costs O(K) and the whole clip O(F*K).
+
+    Args:
+        distances (numpy.array): Distance of every frame to every reference, shape (F, K).
+        penalty (float): Cost of a change of reference.
+
+    Returns:
+        numpy.array: Reference index of each frame, shape (F,).
+    """
+    frames = len(distances)
+    labels = np.zeros(frames,dtype=np.int64)
+    if frames == 0:
+        return labels
+    # the best path to a reference either stays on it or switches from the best reference of the previous frame
+    switched = np.zeros(distances.shape,dtype=bool)
+    best_previous = np.zeros(frames,dtype=np.int64)
+    cost = np.array(distances[0],dtype=np.float64)
+    for t in range(1,frames):
+        best = int(np.argmin(cost))
+        switch = cost[best] + penalty
+        switched[t] = switch < cost
+        best_previous[t] = best
+        cost = np.where(switched[t],switch,cost) + distances[t]
+    state = int(np.argmin(cost))
+    for t in range(frames-1,-1,-1):
+        labels[t] = state
+        if switched[t,state]:
+            state = int(best_previous[t])
+    return labels
+
+def sparse_viterbi_segments(candidates,distances,penalty):
+    """
+    Viterbi decoding of viterbi_segments() restricted to a few candidate references per frame, e.g. the k nearest ones
+    found by the search index, so that memory and time are O(F*k) whatever the size of the library.
+    A frame may stay on its reference only when the reference is also a candidate of the previous frame.
+    Equal to viterbi_segments() when every frame has all the references as candidates.
+
+    Args:
+        candidates (numpy.array): Reference index of the candidates of each frame, shape (F, k).
+        distances (numpy.array): Distance of every frame to its candidates, shape (F, k).
+        penalty (float): Cost of a change of reference.
+
+    Returns:
+        numpy.array: Reference index of each frame, shape (F,).
+    """
+    frames = len(candidates)
+    labels = np.zeros(frames,dtype=np.int64)
+    if frames == 0:
+        return labels
+    # position of the previous candidate each candidate comes from
+    back = np.zeros(candidates.shape,dtype=np.int64)
+    cost = np.array(distances[0],dtype=np.float64)
+    for t in range(1,frames):
+        best = int(np.argmin(cost))
+        switch = cost[best] + penalty
+        stay_cost = np.where(candidates[t][:,None] == candidates[t-1][None,:],cost[None,:],np.inf)
+        stay_from = np.argmin(stay_cost,axis=1)
+        stay = stay_cost[np.arange(len(stay_from)),stay_from]
+        stayed = stay <= switch
+        back[t] = np.where(stayed,stay_from,best)
+        cost = np.where(stayed,stay,switch) + distances[t]
+    state = int(np.argmin(cost))
+    for t in range(frames-1,-1,-1):
+        labels[t] = candidates[t,state]
+        state = int(back[t,state])
+    return labels
+
+def run_lengths(labels):
+    """
+    Run-length encode a sequence of labels.
+
+    Args:
+        labels (numpy.array): Label of each frame.
+
+    Returns:
+        list: (label, start, end) tuples, end excluded.
+    """
+    labels = np.asarray(labels)
+    if len(labels) == 0:
+        return []
+    starts = np.flatnonzero(np.r_[True,labels[1:] != labels[:-1]])
+    ends = np.r_[starts[1:],len(labels)]
+    return [(int(labels[start]),int(start),int(end)) for start,end in zip(starts,ends)]
@@ -0,0 +1,313 @@
+import numpy as np
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor,ThreadPoolExecutor,as_completed
+from contextlib import contextmanager
+from src.frame_pipeline import DEFAULT_QUEUE_DEPTH,frame_count,frame_rate,read_frames,sampling_stride
+from src.landmark_cache import content_key
+from src.metrics import metrics
+
+# cv2 and mediapipe are imported on first use so that the web process starts without them.
+# Number of landmarks detected by MediaPipe Pose.
+N_LANDMARKS = 33
+
+# Settings of the pose estimation, part of the landmark cache key.
+POSE_SETTINGS = {"min_detection_confidence":0.5,"min_tracking_confidence":0.5,"model_complexity":1}
+
+# Version of the landmark tensor layout, part of the landmark cache key.
+LANDMARK_FORMAT = 2
+
+# Frames processed before each segment boundary so that the pose tracking is warmed up.
+DEFAULT_SEGMENT_OVERLAP = 15
+
+# Segments shorter than this are not worth a separate process.
+MIN_SEGMENT_FRAMES = 120
+
+# Frame rate of the annotated preview videos written in debug mode, when the frame rate of the source is unknown.
+PREVIEW_FPS = 30
+
+# Size of the blank frame used to warm up the pose graphs.
+WARM_UP_SIZE = (256,256)
+
+############################################################################################################################################
+################################################################ POSE POOL  ################################################################
+############################################################################################################################################
+
+# Pose graphs of this process that are not in use, reused across videos.
+_idle_poses = []
+_pool_lock = threading.Lock()
+
+def _new_pose():
+    import mediapipe as mp
+    return mp.solutions.pose.Pose(**POSE_SETTINGS)
+
+@contextmanager
+def acquire_pose():
+    """
+    Borrow a Pose graph from the pool of the process, building one if none is idle.
+    The graph is reset when it is given back, so that the tracking state of a video never leaks into the next one.
+
+    Yields:
+        mediapipe.solutions.pose.Pose: A Pose graph for the exclusive use of the caller.
+    """
+    with _pool_lock:
+        pose = _idle_poses.pop() if _idle_poses else None
+    if pose is None:
+        pose = _new_pose()
+    try:
+        yield pose
+    except BaseException:
+        pose.close()
+        raise
+    pose.reset()
+    with _pool_lock:
+        _idle_poses.append(pose)
+
+def warm_up_poses(count=1):
+    """
+    Build the Pose graphs of the process and run them once on a blank frame, so that the model loading and
+    the first inference are not paid by the first video. Called when a Celery worker process starts.
+
+    Args:
+        count (int): Number of graphs to keep ready, one per segment processed in parallel.
+    """
+    blank = np.zeros((*WARM_UP_SIZE,3),dtype=np.uint8)
+    poses = [_new_pose() for _ in range(max(0,count-len(_idle_poses)))]
+    for pose in poses:
+        pose.process(blank)
+        pose.reset()
+    with _pool_lock:
+        _idle_poses.extend(poses)
+
+def close_poses():
+    """
+    Release the idle Pose graphs of the process.
+    """
+    with _pool_lock:
+        poses = _idle_poses[:]
+        del _idle_poses[:]
+    for pose in poses:
+        pose.close()
+
+
+############################################################################################################################################
+################################################################ LANDMARK EXTRACTION  ######################################################
+############################################################################################################################################
+
+def preview_rate(source,sampling=None):
+    """
+    Args:
+        source (str): Path or URL of the video.
+        sampling (dict): Sampling of the analysed frames, see frame_pipeline.read_frames().
+
+    Returns:
+        float: Frame rate of the preview, which only holds the sampled frames, so that it plays at the speed of the source.
+    """
+    fps = frame_rate(source)
+    if fps <= 0:
+        return PREVIEW_FPS
+    sampling = sampling or {}
+    return fps / sampling_stride(fps,sampling.get('stride',1),sampling.get('target_fps'))
+
+def _render(img,results,writer,preview,fps=PREVIEW_FPS):
+    """
+    Debug mode: draw the detected landmarks on a frame and append it to the preview video.
+
+    Args:
+        img (numpy.array): RGB frame.
+        results: Output of pose.process() for the frame.
+        writer (cv2.VideoWriter): Writer of the preview, None before the first frame.
+        preview (str): Path of the preview video.
+        fps (float): Frame rate of the preview, see preview_rate().
+
+    Returns:
+        cv2.VideoWriter: The writer of the preview.
+    """
+    import cv2
+    import mediapipe as mp
+    mp_drawing = mp.solutions.drawing_utils
+    mp_pose = mp.solutions.pose
+    img = cv2.cvtColor(img,cv2.COLOR_RGB2BGR)
+    mp_drawing.draw_landmarks(img,results.pose_landmarks, mp_pose.POSE_CONNECTIONS,
+                            mp_drawing.DrawingSpec(color=(245,117,66),thickness=2,circle_radius=2),
+                            mp_drawing.DrawingSpec(color=(245,66,230),thickness=2,circle_radius=2))
+    if writer is None:
+        writer = cv2.VideoWriter(preview,cv2.VideoWriter_fourcc(*'mp4v'),fps,(img.shape[1],img.shape[0]))
+    writer.write(img)
+    return writer
+
+def allocate_landmarks(frames):
+    """
+    Allocate the landmark buffer of a clip.
+
+    Args:
+        frames (int): Number of frames.
+
+    Returns:
+        tuple: Landmarks of shape (frames, 33, 4) in float32 (x, y, z, visibility) and detection mask of shape (frames,).
+    """
+    return np.zeros((frames,N_LANDMARKS,4),dtype=np.float32),np.zeros(frames,dtype=bool)
+
+def _extract_range(source,queue_depth,start=0,stop=None,sampling=None,preview=None,progress=None,stages=None):
+    """
+    Run pose estimation on a range of frames of a video, writing the landmarks into a buffer preallocated for the clip.
+    Frames left out by the sampling carry the landmarks of the last analysed frame forward.
+    The Pose graph is borrowed from the pool of the process. Nothing is drawn unless a preview path is given (debug mode).
+
+    Args:
+        source (str): Path or URL of the video.
+        queue_depth (int): Number of decoded frames buffered ahead of the pose inference.
+        start (int): Index of the first frame.
+        stop (int): Index after the last frame, None for the end of the video.
+        sampling (dict): Keyword arguments of frame_pipeline.read_frames() selecting the analysed frames (stride, target_fps, threshold).
+        preview (str): Debug mode: path of an annotated preview video of the analysed frames.
+        progress (callable): Called with the processed fraction of the range, at most once per percent.
+        stages (dict): Time of the decode, colour and inference stages in seconds, updated in place (benchmark).
+            Decoding and colour conversion run in their own thread, overlapping the inference.
+
+    Returns:
+        tuple: Landmarks of shape (F, 33, 4) and detection mask of shape (F,).
+    """
+    expected = (stop if stop is not None else frame_count(source)) - start
+    landmarks,detected = allocate_landmarks(max(1,expected))
+    n = 0
+    reported = 0
+    writer = None
+    fps = preview_rate(source,sampling) if preview is not None else None
+    inference_time = 0.0
+    inferred = dropped = 0
+    with acquire_pose() as pose:
+        #frames are decoded and recolored in a separate thread
+        for frame,img in read_frames(source,queue_depth,start,stop,**(sampling or {}),stages=stages):
+
+            #the frame count of the container can be wrong: grow the buffer
+            if n == len(landmarks):
+                more_landmarks,more_detected = allocate_landmarks(len(landmarks))
+                landmarks = np.concatenate((landmarks,more_landmarks))
+                detected = np.concatenate((detected,more_detected))
+
+            if progress is not None and expected > 0 and 100*n // expected > reported:
+                reported = 100*n // expected
+                progress(min(1.0,n/expected))
+
+            #frame not sampled: keep the previous landmarks
+            if img is None:
+                if n > 0:
+                    landmarks[n] = landmarks[n-1]
+                    detected[n] = detected[n-1]
+                n += 1
+                continue
+
+            #detect the pose
+            tic = time.perf_counter()
+            results = pose.process(img)
+            inference_time += time.perf_counter() - tic
+            inferred += 1
+
+            #landmark extraction, missing detections stay at zero
+            if results.pose_landmarks is not None:
+                landmarks[n] = [(lm.x,lm.y,lm.z,lm.visibility) for lm in results.pose_landmarks.landmark]
+                detected[n] = True
+            else:
+                dropped += 1
+            n += 1
+
+            if preview is not None:
+                writer = _render(img,results,writer,preview,fps)
+    if writer is not None:
+        writer.release()
+    metrics.observe("stage",inference_time,inferred,stage="inference")
+    if stages is not None:
+        stages["inference"] = stages.get("inference",0.0) + inference_time
+    metrics.inc("frames_total",n)
+    metrics.inc("dropped_detections_total",dropped)
+    return landmarks[:n],detected[:n]
+
+def _extract_segment(segment):
+    """
+    Run pose estimation on one segment, starting a few frames earlier to warm up the tracking.
+    Top-level function so that it can be sent to a worker process.
+
+    Args:
+        segment (tuple): Source, queue depth, first frame, frame after the last one, overlap and sampling.
+
+    Returns:
+        tuple: Landmarks and detection mask of the segment frames only.
+    """
+    source,queue_depth,start,stop,overlap,sampling = segment
+    warm_start = max(0,start-overlap)
+    landmarks,detected = _extract_range(source,queue_depth,warm_start,stop,sampling)
+    return landmarks[start-warm_start:],detected[start-warm_start:]
+
+def extract_landmarks(source,queue_depth=DEFAULT_QUEUE_DEPTH,segments=1,overlap=DEFAULT_SEGMENT_OVERLAP,sampling=None,preview=None,progress=None):
+    """
+    Run pose estimation on every frame of a video and return the raw landmarks.
+    With several segments, the video is split in time and each segment runs in its own process with its own Pose instance.
+
+    Args:
+        source (str): Path or URL of the video.
+        queue_depth (int): Number of decoded frames buffered ahead of the pose inference.
+        segments (int): Number of segments processed in parallel.
+        overlap (int): Number of frames processed before each segment boundary to warm up the tracking.
+        sampling (dict): Keyword arguments of frame_pipeline.read_frames() selecting the analysed frames (stride, target_fps, threshold).
+        preview (str): Debug mode: path of an annotated preview video. The video is then processed in a single segment.
+        progress (callable): Called with the processed fraction of the video (per percent, or per segment when split).
+
+    Returns:
+        tuple: Landmarks of shape (F, 33, 4) in float32 as returned by MediaPipe (x, y, z, visibility), zeros when no pose
+            is detected, and detection mask of shape (F,).
+    """
+    total = frame_count(source) if segments > 1 and preview is None else 0
+    segments = min(segments,total // MIN_SEGMENT_FRAMES)
+    if segments <= 1:
+        return _extract_range(source,queue_depth,sampling=sampling,preview=preview,progress=progress)
+    bounds = [i * total // segments for i in range(segments)] + [None]
+    jobs = [(source,queue_depth,bounds[i],bounds[i+1],overlap,sampling) for i in range(segments)]
+    # Celery prefork children are daemonic and cannot start processes: use threads there instead
+    if multiprocessing.current_process().daemon:
+        executor = ThreadPoolExecutor(max_workers=segments)
+    else:
+        executor = ProcessPoolExecutor(max_workers=segments)
+    with executor:
+        futures = [executor.submit(_extract_segment,job) for job in jobs]
+        for done,future in enumerate(as_completed(futures)):
+            if progress is not None:
+                progress((done+1)/segments)
+        parts = [future.result() for future in futures]
+    return np.concatenate([part[0] for part in parts]),np.concatenate([part[1] for part in parts])
+
+
+############################################################################################################################################
+################################################################ SHARED ANALYSIS  ##########################################################
+############################################################################################################################################
+
+def analyse_video(source,cache=None,queue_depth=DEFAULT_QUEUE_DEPTH,segments=1,overlap=DEFAULT_SEGMENT_OVERLAP,sampling=None,preview=None,progress=None):
+    """
+    Extract the landmarks of a video once, so that the classification and the animation can both be derived from them.
+    Local files are looked up in the landmark cache by content before any decoding; remote sources are always processed,
+    so stored videos are first copied locally, see storage.local_copy().
+
+    Args:
+        source (str): Path or URL of the video.
+        cache (LandmarkCache): Cache of the extracted landmarks. No caching when None.
+        queue_depth (int): Number of decoded frames buffered ahead of the pose inference.
+        segments (int): Number of segments processed in parallel.
+        overlap (int): Number of frames processed before each segment boundary to warm up the tracking.
+        sampling (dict): Keyword arguments of frame_pipeline.read_frames() selecting the analysed frames, part of the cache key.
+        preview (str): Debug mode: path of an annotated preview video. The cache is bypassed since the frames must be rendered.
+        progress (callable): Called with the processed fraction of the video.
+
+    Returns:
+        tuple: Landmarks of shape (F, 33, 4) and detection mask of shape (F,), see extract_landmarks().
+    """
+    if cache is None or preview is not None or not isinstance(source,str) or not os.path.isfile(source):
+        return extract_landmarks(source,queue_depth,segments,overlap,sampling,preview,progress)
+    key = content_key(source,dict(POSE_SETTINGS,format=LANDMARK_FORMAT,**(sampling or {})))
+    cached = cache.get(key)
+    metrics.inc("landmark_cache_total",result="miss" if cached is None else "hit")
+    if cached is None:
+        cached = extract_landmarks(source,queue_depth,segments,overlap,sampling,progress=progress)
+        cache.set(key,*cached)
+    return cached
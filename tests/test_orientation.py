@@ -0,0 +1,53 @@
+import numpy as np
+
+from src.angle_calculation import LEFT_HIP,LEFT_SHOULDER,RIGHT_HIP,RIGHT_SHOULDER,pelvis_orientation
+from src.angle_classification import DIRECTION_OFFSETS,orientation_costs,orientation_variants
+
+
+def heading(direction,rotation):
+    return (rotation + DIRECTION_OFFSETS[direction]) % 360
+
+def turn(a,b):
+    return abs((a - b + 180) % 360 - 180)
+
+def test_each_heading_has_one_variant_per_lean():
+    grid,headings = orientation_variants()
+    pairs = {}
+    for (direction,rotation,lean),value in zip(grid,headings):
+        assert pairs.setdefault((value,lean),(direction,rotation)) == (direction,rotation)
+    assert len(pairs) == len(grid)
+
+def test_yaw_sweep_reports_the_nearest_heading():
+    grid,headings = orientation_variants()
+    canonical = {0:("north",0),45:("northwest",0),90:("north",90),135:("northwest",90),180:("north",180),
+                 225:("northwest",180),270:("north",270),315:("northeast",0),345:("northeast",30)}
+    yaw = np.arange(0,360,15)
+    variants = np.argmin(orientation_costs(yaw,np.zeros(len(yaw))),axis=1)
+    for angle,variant in zip(yaw.tolist(),variants.tolist()):
+        direction,rotation,lean = grid[variant]
+        assert lean == "straight"
+        assert turn(angle,heading(direction,rotation)) == min(turn(angle,value) for value in headings)
+        if angle in canonical:
+            assert (direction,rotation) == canonical[angle]
+
+def upright_landmarks(frames):
+    # facing the camera: left hip on the right of the image, shoulders above the hips (y grows downwards)
+    landmarks = np.zeros((frames,33,3))
+    landmarks[:,LEFT_HIP] = (0.55,0.6,0.0)
+    landmarks[:,RIGHT_HIP] = (0.45,0.6,0.0)
+    landmarks[:,LEFT_SHOULDER] = (0.55,0.3,0.0)
+    landmarks[:,RIGHT_SHOULDER] = (0.45,0.3,0.0)
+    return landmarks
+
+def test_undetected_frames_keep_the_previous_orientation():
+    landmarks = upright_landmarks(6)
+    detected = np.array([False,True,True,False,False,True])
+    landmarks[~detected] = 0
+    yaw,pitch = pelvis_orientation(landmarks,detected)
+    assert np.allclose(yaw,0) and np.allclose(pitch,0)
+
+def test_undetected_clip_is_neutral():
+    yaw,pitch = pelvis_orientation(np.zeros((4,33,3)),np.zeros(4,dtype=bool))
+    variants = np.argmin(orientation_costs(yaw,pitch),axis=1)
+    assert np.allclose(yaw,0) and np.allclose(pitch,0)
+    assert all(orientation_variants()[0][variant] == ("north",0,"straight") for variant in variants)
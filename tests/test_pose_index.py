@@ -0,0 +1,32 @@
+import numpy as np
+
+from src.pose_index import IVFIndex,build_index
+
+
+def index_with_empty_lists(tmp_path,vectors,empty):
+    """
+    Build the index of the vectors, then add lists without references whose centroids are the given points.
+    """
+    prefix = str(tmp_path / "library")
+    index_prefix = build_index(prefix,vectors,lists=4)
+    centroids = np.load(f"{index_prefix}.centroids.npy")
+    offsets = np.load(f"{index_prefix}.offsets.npy")
+    np.save(f"{index_prefix}.centroids.npy",np.concatenate((centroids,empty)))
+    np.save(f"{index_prefix}.offsets.npy",np.concatenate((offsets,np.repeat(offsets[-1:],len(empty)))))
+    return IVFIndex(prefix,nprobe=1)
+
+def exact(frames,vectors,k):
+    dist = np.linalg.norm(frames[:,None]-vectors[None],axis=-1)
+    return np.sort(dist,axis=1)[:,:k]
+
+def test_frames_probing_empty_lists_are_searched_again(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.uniform(0,1,(200,18))
+    empty = np.full((2,18),50.0)
+    index = index_with_empty_lists(tmp_path,vectors,empty)
+    frames = np.concatenate((vectors[:5],empty + rng.normal(0,0.1,empty.shape)))
+    for k in (1,3):
+        ids,dist = index.search(frames,k)
+        assert (ids >= 0).all()
+        assert np.allclose(dist[5:],exact(frames[5:],vectors,k))
+        assert np.allclose(np.linalg.norm(frames[:,None]-vectors[ids],axis=-1),dist,atol=1e-6)
@@ -0,0 +1,56 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from src import angle_classification
+from src.angle_classification import REFERENCE_FILE,nearest_references,segment_classification
+from src.pose import Pose
+from src.temporal import sparse_viterbi_segments,viterbi_segments
+
+
+@pytest.fixture
+def references(monkeypatch):
+    """
+    Install an in-memory reference set of K random poses, searched exactly, in place of the reference file.
+    """
+    def install(count,codes,seed=0):
+        matrix = np.random.default_rng(seed).uniform(0,180,(count,18))
+        poses = [Pose.from_code(0)] * count
+        for row,code in codes.items():
+            poses[row] = Pose.from_code(code)
+        monkeypatch.setitem(angle_classification._references,REFERENCE_FILE,([str(i) for i in range(count)],poses,matrix))
+        monkeypatch.setitem(angle_classification._indexes,REFERENCE_FILE,None)
+        return matrix
+    return install
+
+def test_sparse_matches_dense_with_every_candidate():
+    rng = np.random.default_rng(1)
+    frames,references = rng.uniform(0,10,(200,4)),rng.uniform(0,10,(30,4))
+    for penalty in (0.0,5.0,50.0):
+        dense = viterbi_segments(np.linalg.norm(frames[:,None]-references[None],axis=-1),penalty)
+        sparse = sparse_viterbi_segments(*nearest_references(frames,references,len(references)),penalty)
+        assert np.array_equal(dense,sparse)
+
+def test_sparse_removes_flicker():
+    # the second candidate of frame 2 would win alone, but not by enough to pay two switches
+    candidates = np.array([[0,1],[0,1],[1,0],[0,1],[0,1]])
+    distances = np.array([[0.0,3.0],[0.0,3.0],[1.0,2.0],[0.0,3.0],[0.0,3.0]])
+    assert sparse_viterbi_segments(candidates,distances,2.0).tolist() == [0,0,0,0,0]
+    assert sparse_viterbi_segments(candidates,distances,0.1).tolist() == [0,0,1,0,0]
+
+def test_segments_a_large_library_without_dense_distances(references,monkeypatch):
+    count,frames_per_segment = 20000,300
+    planted = {11:10000,4242:20000,17777:30000}
+    matrix = references(count,planted)
+    rng = np.random.default_rng(2)
+    frames = np.concatenate([matrix[row] + rng.normal(0,1,(frames_per_segment,18)) for row in planted])
+    monkeypatch.setattr(angle_classification,'DISTANCE_BLOCK_SIZE',1 << 16)
+    tracemalloc.start()
+    segments = segment_classification(frames,min_frames=5)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert [(pose.code,start,end) for pose,start,end in segments] == \
+        [(code,i*frames_per_segment,(i+1)*frames_per_segment) for i,code in enumerate(planted.values())]
+    # a dense (F, K) distance matrix alone would take 144 MB
+    assert peak < len(frames) * count * 8 / 4